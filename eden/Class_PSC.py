@@ -7,11 +7,22 @@ mona.piotter@mpi-hd.mpg.de
 florian.joerg@mpi-hd.mpg.de
 """
 
+import logging as _lg
 import serial
 #from eden import fake_serial as serial
+from eden import clock as _clock
+from eden import fake_serial as _sim
+from eden import framing as _frm
+from eden import replay as _replay
+from eden import telemetry as _tel
+
+_psc_log = _lg.getLogger("eden.Class_PSC")
+TERMINATOR = _frm.TERMINATOR
+# ports of the simulated and the replayed board, by scheme
+PORT_SCHEMES = {_sim.SCHEME: _sim.Serial, _replay.SCHEME: _replay.Serial}
 
 class PSC:
-    def __init__(self,port,channel):
+    def __init__(self,port,channel,channels=None):
         self.reader_thread = None
         self.board_busy = False
     
@@ -21,10 +32,25 @@ class PSC:
         self.rtscts=False
         self.stopbits=1
         self.serial_conn=None
+        self.frames=None
         self.is_connected = False
         self.board_active = False
         
         self.channel = channel
+        # all channels polled on this connection, the first one is channel
+        self.channels = [channel] + [ch for ch in (channels or []) if ch != channel]
+        # channel the board currently addresses, None if not known
+        self.active_channel = None
+        # last measured (voltage, current) of every channel
+        self.readings = {ch: (float('nan'), float('nan')) for ch in self.channels}
+        # eden.clock times of the readings, (voltage time, current time)
+        self.reading_times = {ch: (float('nan'), float('nan')) for ch in self.channels}
+        # (voltage, current) of every channel kept from an earlier round
+        self.reading_stale = {ch: (True, True) for ch in self.channels}
+        # (request, response) times of the queries of the last query() call
+        self.query_times = []
+        # round-trip times, error counters and sample rate
+        self.telemetry = _tel.Telemetry()
         self.power_output = float('nan')
         self.set_vol = float('nan')
         self.set_cu = float('nan')
@@ -49,8 +75,15 @@ class PSC:
         self.timeout=timeout
          
     def establish_connection(self):
-        self.serial_conn = serial.Serial(port=self.port, baudrate= self.baudrate, timeout=self.response_timeout, 
+        # sim:// and replay:// ports connect to a simulated board
+        connection = serial.Serial
+        for scheme, simulated in PORT_SCHEMES.items():
+            if self.port.startswith(scheme):
+                connection = simulated
+        self.serial_conn = connection(port=self.port, baudrate= self.baudrate, timeout=self.response_timeout, 
                                          parity=serial.PARITY_NONE, rtscts=self.rtscts, stopbits=self.stopbits)
+        # replies are read in bulk and split on the terminator
+        self.frames = _frm.FrameReader(self.serial_conn, TERMINATOR)
         if self.serial_conn.is_open:
             self.is_connected = True
     
@@ -59,14 +92,33 @@ class PSC:
 
         self.serial_conn.write(b"CH "+str(self.channel).encode()+b"\n")
         answer = self.read()
+        self.active_channel = self.channel
         if answer is self.channel:
             self.board_active = True
+
+    def select_channel (self, channel):
+        # CH is only sent when the board addresses another channel
+        if channel != self.active_channel:
+            self.serial_conn.write(b"CH "+str(channel).encode()+b"\n")
+            self.read()
+            self.active_channel = channel
         
+    def read_frame (self):
+        # the raw reply, float() and int() parse numbers from it directly
+        a=self.frames.read_frame()
+        if a is None:
+            # the read timed out
+            self.telemetry.count("timeouts")
+            return b""
+        return a
+
     def read (self):
-        a=self.serial_conn.read_until(b'\n\r\x04')
-        a=a.split(b'\n\r\x04')
-        a=a[0]  
-        return a.decode()
+        return self.read_frame().decode()
+
+    def parse_error (self):
+        # an unparseable reply, the previous value is kept
+        self.telemetry.count("parse_errors")
+        _psc_log.warning("Wrong data type returned from board!")
 
     
     def get_channel (self):
@@ -76,55 +128,162 @@ class PSC:
     def get_set_vol (self):
         self.serial_conn.write(b"SO:VO?\n")
         try:
-            self.set_vol = float(self.read())
+            self.set_vol = float(self.read_frame())
         except (TypeError, ValueError):
-            print("Wrong data type returned from board!")
+            self.parse_error()
     
     def get_set_cu (self):
         self.serial_conn.write(b"SO:CU?\n")
         try:
-            self.set_cu = float(self.read())
+            self.set_cu = float(self.read_frame())
         except (TypeError, ValueError):
-            print("Wrong data type returned from board!")        
+            self.parse_error()
 
     
     def get_mea_vol (self):
         self.serial_conn.write(b"ME:VO?\n")
         try:
-            self.mea_vol = float(self.read())
+            self.mea_vol = float(self.read_frame())
         except (TypeError, ValueError):
-            print("Wrong data type returned from board!")    
+            self.parse_error()
 
    
     def get_mea_cu (self):
         self.serial_conn.write(b'ME:CU?\n') 
         try:
-            self.mea_cu = float(self.read())
+            self.mea_cu = float(self.read_frame())
         except (TypeError, ValueError):
-            print("Wrong data type returned from board!")    
+            self.parse_error()
 
     
+    def query (self, commands):
+        # write all commands back-to-back, so the board works on the next one
+        # while the previous reply is on its way, then read the replies in order
+        requested = _clock.now()
+        self.serial_conn.write(b"".join(command.encode()+b"\n" for command in commands))
+        answers = []
+        self.query_times = []
+        for command in commands:
+            answer = self.frames.read_frame()
+            answered = _clock.now()
+            if answer is None:
+                # timed out: a reply got lost and every one read after it
+                # was taken for the reply of the command before, which one
+                # is unknown, so the whole round is missing. Late replies
+                # must not end up in the next round.
+                self.telemetry.count("timeouts")
+                self.serial_conn.reset_input_buffer()
+                self.frames.reset()
+                self.query_times = [(requested, answered)] * len(commands)
+                return [None] * len(commands)
+            answers.append(answer)
+            self.query_times.append((requested, answered))
+            self.telemetry.record_round_trip(command, answered - requested)
+            # the board takes on the next query once this one is answered
+            requested = answered
+        return answers
+
+    def measure (self, commands):
+        values = []
+        for answer in self.query(commands):
+            if answer is None:
+                values.append(None)
+                continue
+            try:
+                values.append(float(answer))
+            except (TypeError, ValueError):
+                self.parse_error()
+                values.append(None)
+        return values
+
+    def get_mea_vol_cu (self):
+        # one pipelined round-trip for both measured values
+        voltage, current = self.measure(["ME:VO?", "ME:CU?"])
+        if voltage is not None:
+            self.mea_vol = voltage
+        if current is not None:
+            self.mea_cu = current
+        if voltage is None or current is None:
+            self.telemetry.count("stale_samples")
+        self.telemetry.record_sample()
+
+    def get_mea_vol_cu_channels (self, channels=None):
+        # one round over the channels in a single pipelined write
+        channels, commands = self.channel_round(channels)
+        self.store_channel_round(channels, commands, self.query(commands))
+        return channels
+
+    def channel_round (self, channels=None):
+        # channel order and commands of a measurement round, grouped by
+        # channel and starting with the active one to save a CH switch
+        channels = list(channels or self.channels)
+        if self.active_channel in channels:
+            start = channels.index(self.active_channel)
+            channels = channels[start:] + channels[:start]
+        commands = []
+        active = self.active_channel
+        for channel in channels:
+            if channel != active:
+                commands.append("CH "+str(channel))
+                active = channel
+            commands.extend(("ME:VO?", "ME:CU?"))
+        return channels, commands
+
+    def store_channel_round (self, channels, commands, answers, times=None):
+        # keep the last valid reading of a channel (and its time) if a reply
+        # is garbled or missing (None), a reading is timestamped with the
+        # midpoint of its query
+        if times is None:
+            times = self.query_times
+        measured = [(answer, (requested+answered)/2.) for command, answer, (requested, answered)
+                    in zip(commands, answers, times) if not command.startswith("CH ")]
+        answers = iter(measured)
+        if channels:
+            self.active_channel = channels[-1]
+        for channel in channels:
+            reading = list(self.readings.get(channel, (float('nan'), float('nan'))))
+            reading_time = list(self.reading_times.get(channel, (float('nan'), float('nan'))))
+            stale = [False, False]
+            for i in range(2):
+                answer, answer_time = next(answers)
+                if answer is None:
+                    stale[i] = True
+                    continue
+                try:
+                    reading[i] = float(answer)
+                    reading_time[i] = answer_time
+                except (TypeError, ValueError):
+                    self.parse_error()
+                    stale[i] = True
+            self.readings[channel] = tuple(reading)
+            self.reading_times[channel] = tuple(reading_time)
+            self.reading_stale[channel] = tuple(stale)
+            if any(stale):
+                self.telemetry.count("stale_samples")
+        self.telemetry.record_sample(len(channels))
+        self.mea_vol, self.mea_cu = self.readings.get(self.channel, (self.mea_vol, self.mea_cu))
+
     def get_max_vol (self):
         self.serial_conn.write(b"SO:VO:MA?\n")
         try:
-            self.max_vol = float(self.read())
+            self.max_vol = float(self.read_frame())
         except (TypeError, ValueError):
-            print("Wrong data type returned from board!")            
+            self.parse_error()
         
     def get_max_cu (self):
         self.serial_conn.write(b"SO:CU:MA?\n")
         try:
-            self.max_cu = float(self.read())
+            self.max_cu = float(self.read_frame())
         except (TypeError, ValueError):
-            print("Wrong data type returned from board!")  
+            self.parse_error()
 
     
     def get_remote (self):                         
         self.serial_conn.write(b"REM?\n")
         try:
-            self.remote = int(self.read())
+            self.remote = int(self.read_frame())
         except (TypeError, ValueError):
-            print("Wrong data type returned from board!")  
+            self.parse_error()
 
         if self.remote == 1:
             print('remote because')
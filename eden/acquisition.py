@@ -0,0 +1,357 @@
+"""
+Acquisition of a PSC, independent of any user interface.
+
+Acquisition polls every channel of the board, applies the queued commands
+between two measurement rounds and records the samples to crash journals. A
+target (eden.target) zeroes the output of a channel as soon as its charge
+reaches it, checked on every reading. A setpoint program (eden.program)
+runs between the rounds, a round that would delay its next setpoint waits
+for it; within a pulse train only the channel of the program is measured,
+when that fits between two phases. Every setpoint written is kept in
+setpoint_log.
+
+run() is the acquisition loop until request_stop(); eden.threads.PscReader
+runs it on a QThread for the GUI, eden.daemon on a plain thread without Qt.
+"""
+
+import collections
+import logging as _lg
+import time
+
+from eden import buffer as _buf
+from eden import clock as _clock
+from eden import command_queue as _cmd
+from eden import journal as _jnl
+from eden import program as _prg
+from eden import recording as _rec
+from eden import session_file as _sf
+
+_acq_log = _lg.getLogger("eden.acquisition")
+
+# longest wait (s) for a queued command while the next poll is not due
+COMMAND_LATENCY = 0.05
+# longest time (s) a program holds back the measurements for its setpoints,
+# except during a pulse train
+PROGRAM_MAX_HOLD = 1.0
+# number of measurement rounds whose longest time per channel is expected
+# for the next
+N_ROUND_TIMES = 10
+
+
+class CommandOwner:
+    """Thread owning the connection to a PSC.
+
+    Other threads never use the connection, they submit commands which the
+    owner runs between two measurements, setpoints before anything else.
+    Subclasses provide apply_setpoints() and run the commands.
+    """
+
+    def __init__(self, psc_module):
+
+        self.psc = psc_module
+        self.stop_thread = False
+        self.close_on_stop = False
+        self.commands = _cmd.CommandQueue()
+        # called with the message of every failed command
+        self.failure_callbacks = []
+
+    def submit(self, func, *args, priority=_cmd.CONTROL, key=None):
+        """Run func(*args) on the owner thread, returns a Future"""
+        future = self.commands.submit(func, *args, priority=priority, key=key)
+        future.add_done_callback(self._report_failure)
+        return future
+
+    def _report_failure(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            for callback in self.failure_callbacks:
+                callback(str(future.exception()))
+
+    def set_setpoints(self, voltage, current, channel=None):
+        """Queue new voltage and current setpoints of a channel (default psc.channel).
+
+        Setpoints of the channel still pending from an earlier call are dropped.
+        """
+        if channel is None:
+            channel = self.psc.channel
+        return self.submit(self.apply_setpoints, channel, voltage, current,
+                           priority=_cmd.SETPOINT, key=("setpoints", channel))
+
+    def request_stop(self, close_connection=False):
+        """Let the thread finish (and close the connection), without waiting"""
+        self.close_on_stop = close_connection
+        self.stop_thread = True
+
+
+class Acquisition(CommandOwner):
+    """Owns the serial port of the PSC and records its channels"""
+
+    def __init__(self, psc_module):
+
+        CommandOwner.__init__(self, psc_module)
+        self.temp_file_name = None
+        self.is_recording = False
+        # one buffer per polled channel, reader_data is the one of psc.channel
+        self.channel_data = {channel: _buf.SampleBuffer(n_columns=3)
+                             for channel in self.psc.channels}
+        self.reader_data = self.channel_data[self.psc.channel]
+        # crash journals of the recorded samples (journal is the one of
+        # psc.channel) and their sync interval (s)
+        self.journal = None
+        self.journals = {}
+        self.journal_interval = 1.0
+        self.sample_info = _sf.metadata()
+        # poll interval (s), None polls as fast as the port allows
+        self.sample_interval = None
+        # (voltage tolerance, current tolerance, max interval) of deadband
+        # recording, None stores every sample
+        self.deadband = None
+        # interpolate the voltage to the time of the current reading
+        self.align_voltage = False
+        # recorders of the channels, they hold the exact charge
+        self.recorders = {}
+        self.schedule = None
+        # TargetStop of the recording, None records until stopped
+        self.target = None
+        # ProgramRunner of the setpoint program, the setpoints written, the
+        # durations per channel of the last measurement rounds and start of
+        # the last one
+        self.program = None
+        self.setpoint_log = _prg.SetpointLog()
+        self.channel_times = collections.deque(maxlen=N_ROUND_TIMES)
+        self.round_start = None
+        # called with (channel, index of the first row, rows) of every batch
+        # of stored samples, e.g. StreamServer.publish
+        self.publishers = []
+
+    @property
+    def recording_open(self):
+        """True while samples of the recording may still get stored"""
+        return self.is_recording or self.journal is not None
+
+    @property
+    def total_charge(self):
+        """Exact charge (C) of the recording on psc.channel"""
+        recorder = self.recorders.get(self.psc.channel)
+        return None if recorder is None else recorder.charge
+
+    def apply_setpoints(self, channel, voltage, current, scheduled=None, changed=(True, True)):
+
+        # both setpoints (or the changed ones) after a single channel switch
+        self.psc.select_channel(channel)
+        if changed[0]:
+            self.psc.set_set_vol(voltage)
+        if changed[1]:
+            self.psc.set_set_cu(current)
+        self.setpoint_log.add(_clock.now(), channel, voltage, current, scheduled)
+
+    def start_program(self, segments, channel=None):
+        """Queue the start of a setpoint program (see eden.program) on a channel
+        (default psc.channel), it replaces any running one"""
+        if channel is None:
+            channel = self.psc.channel
+        program = _prg.ProgramRunner(segments, channel, None)
+        return self.submit(self._start_program, program, priority=_cmd.SETPOINT, key=("program",))
+
+    def _start_program(self, program):
+
+        # the board would not keep up with the pulses, nor be measured
+        shortest = program.shortest_phase
+        if shortest is not None and not self.channel_times:
+            # nothing measured yet, e.g. a program given at the start
+            self.measure_round(_clock.now(), list(self.channel_data))
+        if shortest is not None and shortest < self.channel_time:
+            raise ValueError("Pulse phases of %g ms are shorter than the measurement of a channel (%g ms)"
+                             % (shortest * 1E3, self.channel_time * 1E3))
+        program.start_time = _clock.now()
+        self.program = program
+        self.run_program()
+
+    def stop_program(self):
+        """Queue the end of the setpoint program, the setpoints stay as they are"""
+        return self.submit(self._stop_program, priority=_cmd.SETPOINT, key=("program",))
+
+    def _stop_program(self):
+
+        if self.program is not None and not self.program.finished:
+            self.program.stopped = True
+            self._report_program()
+
+    def _report_program(self):
+
+        jitter = self.setpoint_log.summary()["jitter"]
+        if jitter["n_window"]:
+            _acq_log.info("program on ch%d ended: %d setpoints, jitter median %.2f ms, max %.2f ms",
+                          self.program.channel, self.program.position,
+                          jitter["p50_s"] * 1E3, jitter["max_s"] * 1E3)
+
+    def run_program(self):
+        """Write the program setpoint due now, if any"""
+        program = self.program
+        if program is None or program.finished:
+            return
+        due, n_skipped = program.pop_due(_clock.now())
+        if due is None:
+            return
+        scheduled, voltage, current = due
+        if n_skipped:
+            self.setpoint_log.skip(n_skipped)
+        # a pulse only changes the current, the board takes a while per command
+        changed = (voltage != program.written[0], current != program.written[1])
+        self.apply_setpoints(program.channel, voltage, current, scheduled, changed)
+        program.written = (voltage, current)
+        if program.finished:
+            self._report_program()
+
+    @property
+    def channel_time(self):
+        """Expected duration (s) of the measurement of one channel"""
+        return max(self.channel_times) if self.channel_times else 0.
+
+    def round_channels(self, now):
+        """Channels to measure now, none if that would delay the next program setpoint"""
+        channels = list(self.channel_data)
+        program = self.program
+        next_time = None if program is None else program.next_time
+        if next_time is None or next_time - now >= self.channel_time * len(channels):
+            return channels
+        if program.in_pulse:
+            # a full round never interrupts a pulse train
+            return [program.channel] if next_time - now >= self.channel_time else []
+        # the measurements are not held back for longer than PROGRAM_MAX_HOLD
+        if self.round_start is None or now - self.round_start <= PROGRAM_MAX_HOLD:
+            return []
+        return channels
+
+    def journal_filename(self, channel):
+        """Crash journal of a channel, the one of psc.channel is temp_file_name"""
+        if channel == self.psc.channel:
+            return self.temp_file_name
+        return self.temp_file_name[:-len(_jnl.EXTENSION)]+"_ch"+str(channel)+_jnl.EXTENSION
+
+    def open_journal(self):
+
+        self.temp_file_name = "tmp_"+str(int(time.time()))+_jnl.EXTENSION
+        for channel in self.channel_data:
+            self.journals[channel] = _jnl.SampleJournal(self.journal_filename(channel), n_columns=3,
+                                                        flush_interval=self.journal_interval,
+                                                        **self.sample_info)
+        self.journal = self.journals[self.psc.channel]
+        self.recorders = {channel: _rec.ChannelRecorder(self.deadband, self.align_voltage)
+                          for channel in self.channel_data}
+        if self.target is not None:
+            self.target.reset()
+
+    def close_journal(self):
+
+        # the last sample of every channel ends the recording
+        for channel, journal in self.journals.items():
+            self.store(channel, self.recorders[channel].finish())
+            journal.close()
+        self.journals = {}
+        self.journal = None
+
+    def store(self, channel, rows):
+
+        start = len(self.channel_data[channel])
+        for row in rows:
+            self.journals[channel].append(row)
+            self.channel_data[channel].append(row)
+        self.journals[channel].set_total_charge(self.recorders[channel].charge)
+        for publish in self.publishers:
+            publish(channel, start, rows)
+
+    def stop_at_target(self, channel):
+        """Zero the output of channel, its charge reached the target"""
+        target = self.target
+        target.detected_time = _clock.now()
+        # a program on the channel would switch it on again
+        if self.program is not None and self.program.channel == channel:
+            self._stop_program()
+        self.apply_setpoints(channel, 0., 0.)
+        target.stopped_time = _clock.now()
+        if target.end_recording:
+            self.is_recording = False
+        _acq_log.info("ch%d: target charge %g C reached, output zeroed after %.1f ms",
+                      channel, target.target, target.latency * 1E3)
+
+    def poll_wait(self, now):
+        """Seconds until the next poll is due, 0 without a poll interval"""
+        if not self.sample_interval:
+            return 0.
+        if self.schedule is None or self.schedule.interval != self.sample_interval:
+            self.schedule = _rec.PollSchedule(self.sample_interval)
+        return self.schedule.remaining(now)
+
+    def due_channels(self, now):
+        """Channels whose measurement round may start now"""
+        return self.round_channels(now) if self.poll_wait(now) <= 0 else []
+
+    def begin_round(self, now):
+
+        if self.sample_interval:
+            self.schedule.advance(now)
+        self.round_start = now
+
+    def end_round(self, channels):
+        """Record the readings of a round started with begin_round()"""
+        self.channel_times.append((_clock.now() - self.round_start) / len(channels))
+        if self.is_recording:
+            if self.journal is None:
+                self.open_journal()
+            target = self.target
+            target_channel = None
+            if target is not None and not target.reached:
+                target_channel = self.psc.channel if target.channel is None else target.channel
+            for channel in channels:
+                if self.psc.reading_stale[channel][1]:
+                    # no new current, the next one is integrated over the gap
+                    continue
+                voltage, current = self.psc.readings[channel]
+                voltage_time, current_time = self.psc.reading_times[channel]
+                if channel == target_channel and target.add(current_time, current):
+                    # before anything else, the rows can wait
+                    self.stop_at_target(channel)
+                self.store(channel, self.recorders[channel].add(voltage_time, voltage,
+                                                                current_time, current))
+        elif self.journal is not None:
+            self.close_journal()
+
+    def poll(self):
+        """One pass of the acquisition loop, returns the measured channels"""
+        self.commands.run_pending()
+        self.run_program()
+        now = _clock.now()
+        channels = self.due_channels(now)
+        if not channels:
+            # queued commands and the program keep running while waiting for
+            # the poll, the next program setpoint is waited for exactly
+            wait = self.poll_wait(now)
+            waits = [COMMAND_LATENCY] + ([wait] if wait > 0 else [])
+            if self.program is not None and self.program.next_time is not None:
+                # with the channel of the program addressed already
+                self.psc.select_channel(self.program.channel)
+                waits.append(self.program.next_time - _clock.now())
+            _clock.sleep(min(waits))
+            return []
+        return self.measure_round(now, channels)
+
+    def measure_round(self, now, channels):
+        """Measure and record a round over channels, returns them in the order measured"""
+        # the board addresses the last one afterwards and the next round
+        # starts there
+        self.begin_round(now)
+        channels = self.psc.get_mea_vol_cu_channels(channels)
+        self.end_round(channels)
+        return channels
+
+    def run(self):
+        
+        self.schedule = None
+        while not self.stop_thread:
+            self.poll()
+        # commands submitted before the stop still reach the board
+        self.commands.run_pending()
+        self.commands.cancel_all()
+        self.close_journal()
+        if self.close_on_stop:
+            self.psc.close_connection()
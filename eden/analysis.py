@@ -1,126 +1,152 @@
-import pylab as plt
-import numpy as np
+"""
+Analysis of coating runs: charge, deposited copper mass, layer thickness
+and deposition rate from the measured current.
+
+All functions work on numpy arrays and have no side effects, they are used
+by the live plot (eden.deposition), the catalog and the batch tools.
+Running the module plots a single run:
+
+    python -m eden.analysis data/2017_05_12_4 --title "Coating WTh 3.3 mm rod C (Side 2) with heater + steerer"
+    python -m eden.analysis data/2017_05_11_1 --length 2.335 --diameter 0.1
+    python -m eden.analysis data/20190606_150509_Tubes_batch2_2.dat
+
+The sample surface is taken from the file header if there is one, else it
+is computed from the rod geometry (in cm, assuming a cylindrical rod).
+"""
+
+import argparse
 import datetime
+import numpy as _np
+
+from eden import decimate as _dec
+from eden import loader as _loader
 
-# user inputs here:
-'''
-voltage_file = ""
-ampereage_file = "2017_05_12_4"
-plot_title = "Coating WTh 3.3 mm rod C (Side 2) with heater + steerer"
-'''
-'''
-voltage_file = ""
-ampereage_file = "2017_05_12_3"
-plot_title = "Coating WTh 3.3 mm rod C (Side 1) with heater + steerer"
-'''
-'''
-voltage_file = ""
-ampereage_file = "2017_05_12_2"
-plot_title = "Coating WTh 3.3 mm rod B (Side 2) with heater + steerer"
-'''
-
-voltage_file = ""
-ampereage_file = "2017_05_12_1"
-plot_title = "Coating WTh 3.3 mm rod B (Side 1) with heater + steerer"
-
-'''
-voltage_file = ""
-ampereage_file = "2017_05_11_1"
-plot_title = "Coating WTh 1 mm rod fragment with heater + steerer"
-'''
-
-
-# all measures in cm (assuming a cylindrical rod)
-#for the 3.3mm rods
-
-coated_length = 18./2
-coated_inner_diameter = 0.33
-
-#for the 1mm rod
-'''
-coated_length = 2.335
-coated_inner_diameter = 0.1
-'''
 # define some constants
-electron_charge = 1.69e-19
-avogadro = 6.02214086e23
-density_copper = 8.92 		# density in g/cm^3
-molar_mass_cu = 63.546
-
-# also load the header in order to match the time axises between both sets
-
-#f1 = open(voltage_file, "r") 
-f2 = open(ampereage_file, "r")
-#volt_header = f1.read()
-amp_header = f2.read()
-format = '%H:%M:%S'
-#volt_start_time = datetime.datetime.strptime(volt_header[11:19], format)
-amp_start_time = datetime.datetime.strptime(amp_header[11:19], format)
-#print("voltage record time:", volt_start_time)
-print("ampereage record time:", amp_start_time)
-'''
-delta_sec =  0
-if(amp_start_time > volt_start_time):
-	delta = amp_start_time - volt_start_time
-	delta_sec = -delta.seconds
-else:
-	delta =  volt_start_time - amp_start_time
-	delta_sec = delta.seconds
-
-print("difference (ampere - volt): ", delta_sec)
-f1.close()
-'''
-f2.close()
-
-# load the two data sets for voltage and ampereage (without header)
-#voltage = np.loadtxt(voltage_file, skiprows=3)
-current = np.loadtxt(ampereage_file, skiprows=3)
-
-integral_charge = np.zeros_like(current[:,1])
-
-for i in range(current.shape[0]-1):
-	
-	integral_charge[i+1] = current[i,1]*(current[i+1,0] - current[i,0]) + integral_charge[i]
-
-total_charge = integral_charge[current.shape[0]-1]
-N_Cu_atoms = total_charge/electron_charge/2.
-
-# copper mass in gramms
-m_cu = N_Cu_atoms/avogadro * molar_mass_cu
-
-print("Deposited copper mass (in gram): ", m_cu)
-
-# assuming rod
-coated_surface = np.pi*coated_inner_diameter*coated_length
-# neglecting effect of increase of diameter due to coating (V = A*coating_thickness)
-
-volume_copper = m_cu/density_copper
-thickness_coating = volume_copper/coated_surface
-
-print("coating thickness (nm) = ", thickness_coating*1e7)
-
-current_density = current[:,1] / coated_surface*1E3
-deposition_rate = current_density /(2*electron_charge)/avogadro * molar_mass_cu *1E3
-
-
-# compute the offset between the data sets and shift the one that was first to start
-#voltage[:,0] += delta_sec
-
-fig = plt.figure()
-ax1 = fig.add_subplot(111)
-plt1 = ax1.plot(current[:,0], current_density , '-b', label='Current')
-ax1.plot(0, 0, '-r', label='Deposited mass')
-ax2 = ax1.twinx()
-plt2 = ax2.plot(current[:,0], integral_charge /(2*electron_charge)/avogadro * molar_mass_cu *1E3, '-r', label='Deposition Rate')
-ax1.legend(loc=0)
-ax1.grid()
-ax1.set_xlabel("Time (s)")
-ax1.set_ylabel("Current density (mA/cm^2)")
-ax2.set_ylabel("Deposited mass (mg)")
-mass_string = "Deposited mass: \n" + "%.4f" % (m_cu*1e3) + " mg\n\nCoating thickness: \n" + "%.2f" % (thickness_coating*1e7) +" nm"
-# str(m_cu*1e3) + "mg"
-text = ax1.text(current[:,0].max()*0.65, current_density.max()*0.6, mass_string)
-plt.title(plot_title)
-plt.show()
-
-fig.savefig("plot.png")
+ELECTRON_CHARGE = 1.69e-19
+AVOGADRO = 6.02214086e23
+DENSITY_CU = 8.92 		# density in g/cm^3
+MOLAR_MASS_CU = 63.546
+
+
+def cumulative_charge(time, current):
+    """Charge (C) deposited up to every sample, trapezoid rule, starts at 0"""
+    charge = _np.zeros(_np.shape(current))
+    if charge.shape[0] > 1:
+        _np.cumsum((time[1:] - time[:-1]) * (current[1:] + current[:-1]) / 2., out=charge[1:])
+    return charge
+
+
+def total_charge(time, current):
+    """Charge (C) of the current (A) over time (s), trapezoid rule"""
+    return _np.sum((time[1:] - time[:-1]) * (current[1:] + current[:-1])) / 2.
+
+
+def deposited_mass(charge):
+    """Deposited copper mass (g) for the given charge (C)"""
+    return charge/ELECTRON_CHARGE/2. / AVOGADRO*MOLAR_MASS_CU
+
+
+def coating_thickness(mass, surface):
+    """Layer thickness (cm) of the given copper mass (g) on surface (cm^2),
+    neglecting the increase of the surface due to the coating"""
+    return mass / DENSITY_CU / surface
+
+
+def current_density(current, surface):
+    """Current density in mA/cm^2"""
+    return current / surface * 1E3
+
+
+def deposition_rate(current, surface):
+    """Deposition rate in ug/(s cm^2)"""
+    return deposited_mass(current_density(current, surface)) * 1E3
+
+
+def rod_surface(diameter, length):
+    """Coated surface (cm^2) of a cylindrical rod"""
+    return _np.pi * diameter * length
+
+
+def summarize(data, surface=None, charge=None):
+    """Charge, mass, thickness and mean current density of a run.
+
+    data holds rows of (time, current, ...). Units: duration in s, charge
+    in C, mass in g, thickness in cm and the time averaged current density
+    in mA/cm^2. Quantities that need the surface are None without one.
+    charge is the exact charge of the run if it was stored with the data,
+    otherwise the rows are integrated.
+    """
+    summary = dict.fromkeys(("duration", "charge", "mass", "thickness", "mean_current_density"))
+    if data.shape[0] < 2:
+        return summary
+    summary["duration"] = data[-1, 0] - data[0, 0]
+    summary["charge"] = total_charge(data[:, 0], data[:, 1]) if charge is None else charge
+    summary["mass"] = deposited_mass(summary["charge"])
+    if surface:
+        summary["thickness"] = coating_thickness(summary["mass"], surface)
+        if summary["duration"] > 0:
+            summary["mean_current_density"] = current_density(
+                summary["charge"] / summary["duration"], surface)
+    return summary
+
+
+def plot_run(data, surface, title="", charge=None):
+    """Current density and deposited mass over time, returns the figure"""
+    import matplotlib.pyplot as plt
+
+    time = data[:, 0] - data[0, 0]
+    cumulative = cumulative_charge(data[:, 0], data[:, 1])
+    density = current_density(data[:, 1], surface)
+    summary = summarize(data, surface, charge)
+
+    fig = plt.figure()
+    ax1 = fig.add_subplot(111)
+    plt1, = ax1.plot([], [], '-b', label='Current')
+    ax1.plot(0, 0, '-r', label='Deposited mass')
+    ax2 = ax1.twinx()
+    plt2, = ax2.plot([], [], '-r', label='Deposition Rate')
+    # hand only a min/max decimated copy to matplotlib, zooming and panning
+    # decimates the visible range again from the full data
+    fig.traces = (_dec.DecimatedLine(plt1), _dec.DecimatedLine(plt2))
+    fig.traces[0].set_data(time, density)
+    fig.traces[1].set_data(time, deposited_mass(cumulative)*1E3)
+    ax1.legend(loc=0)
+    ax1.grid()
+    ax1.set_xlabel("Time (s)")
+    ax1.set_ylabel("Current density (mA/cm^2)")
+    ax2.set_ylabel("Deposited mass (mg)")
+    mass_string = "Deposited mass: \n" + "%.4f" % (summary["mass"]*1e3) + " mg\n\nCoating thickness: \n" + "%.2f" % (summary["thickness"]*1e7) +" nm"
+    ax1.text(time.max()*0.65, _np.nanmax(density)*0.6, mass_string)
+    ax1.set_title(title)
+    return fig
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deposited mass and coating thickness of a run")
+    parser.add_argument("filename")
+    parser.add_argument("--title", default=None)
+    parser.add_argument("--surface", type=float, default=None, help="coated surface (cm^2)")
+    # for the 3.3mm rods
+    parser.add_argument("--length", type=float, default=18./2, help="coated rod length (cm)")
+    parser.add_argument("--diameter", type=float, default=0.33, help="coated rod diameter (cm)")
+    parser.add_argument("--save", default="plot.png", help="file the plot is saved to")
+    args = parser.parse_args()
+
+    data, meta = _loader.load(args.filename)
+    surface = args.surface or meta["sample_surface"] or rod_surface(args.diameter, args.length)
+    summary = summarize(data, surface, meta["total_charge"])
+    print("record time:", datetime.datetime.fromtimestamp(data[0, 0]))
+    print("Deposited copper mass (in gram): ", summary["mass"])
+    print("coating thickness (nm) = ", summary["thickness"]*1e7)
+
+    title = args.title
+    if title is None:
+        title = (meta["sample_name"]+" "+meta["coating_step"]).strip()
+    fig = plot_run(data, surface, title, meta["total_charge"])
+    fig.savefig(args.save)
+    import matplotlib.pyplot as plt
+    plt.show()
+
+
+if __name__ == "__main__":
+    main()
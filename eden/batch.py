@@ -0,0 +1,109 @@
+"""
+Batch analysis of archived runs.
+
+Every file is analysed in a pool of worker processes, using the sample
+surface stored in its own header. The results end up in one tab separated
+summary table with the charge, deposited mass, layer thickness and mean
+current density per file.
+
+Usage:
+    python -m eden.batch data/ [more directories, files or globs]
+                         [-o summary.tsv] [-j N_WORKERS] [--surface CM2]
+"""
+
+import argparse
+import concurrent.futures
+import functools
+import glob
+import os
+import sys
+import numpy as _np
+
+from eden import analysis as _ana
+from eden import loader as _loader
+
+COLUMNS = ("file", "format", "sample_name", "coating_step", "sample_surface", "n_rows",
+           "duration", "charge", "mass", "thickness", "mean_current_density", "error")
+
+
+def expand_paths(paths):
+    """Files given by a list of directories, files and glob patterns"""
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(_loader.list_files(path))
+        elif os.path.isfile(path):
+            filenames.append(path)
+        else:
+            filenames.extend(sorted(name for name in glob.glob(path) if os.path.isfile(name)))
+    # keep the order, drop duplicates
+    return list(dict.fromkeys(filenames))
+
+
+def analyse_file(filename, default_surface=None):
+    """Summary row of a single file.
+
+    Units: duration in s, charge in C, mass in g, thickness in cm and the
+    time averaged current density in mA/cm^2.
+    """
+    row = dict.fromkeys(COLUMNS)
+    row["file"] = filename
+    try:
+        data, meta = _loader.load(filename)
+    except (OSError, ValueError) as err:
+        row["error"] = str(err)
+        return row
+    surface = meta["sample_surface"] if meta["sample_surface"] is not None else default_surface
+    row.update(format=meta["format"], sample_name=meta["sample_name"],
+               coating_step=meta["coating_step"], sample_surface=surface,
+               n_rows=data.shape[0])
+    row.update(_ana.summarize(data, surface, meta["total_charge"]))
+    return row
+
+
+def analyse(filenames, workers=None, default_surface=None):
+    """Summary rows of all files, analysed in parallel"""
+    task = functools.partial(analyse_file, default_surface=default_surface)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return [task(filename) for filename in filenames]
+    # a few chunks per worker keep the load balanced without much overhead
+    chunksize = max(len(filenames) // (4*workers), 1)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(task, filenames, chunksize=chunksize))
+
+
+def _format(value):
+    if value is None:
+        return ""
+    if isinstance(value, (float, _np.floating)):
+        return repr(float(value))
+    return str(value)
+
+
+def write_table(rows, out):
+    out.write("\t".join(COLUMNS)+"\n")
+    for row in rows:
+        out.write("\t".join(_format(row[column]) for column in COLUMNS)+"\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse archived EDen runs in parallel")
+    parser.add_argument("paths", nargs="+", help="directories, files or glob patterns")
+    parser.add_argument("-o", "--output", default=None, help="summary table (default: stdout)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: number of cores)")
+    parser.add_argument("--surface", type=float, default=None,
+                        help="sample surface (cm^2) for files without one in the header")
+    args = parser.parse_args()
+
+    rows = analyse(expand_paths(args.paths), args.workers, args.surface)
+    if args.output:
+        with open(args.output, "w") as f_out:
+            write_table(rows, f_out)
+    else:
+        write_table(rows, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Benchmarks of the EDen hot paths. Results are printed as JSON.
+
+Usage:
+    python -m eden.benchmark [--repeat N] loader [data_dir]
+    python -m eden.benchmark [--repeat N] charge [data_dir] [--files N]
+    python -m eden.benchmark acquisition [--hours H [H ...]] [--channels N]
+                             [--interval S] [--plot-interval S] [--seed N]
+
+The acquisition benchmark records simulated runs (eden.fake_serial on a
+virtual clock) through PSC, PscReader and the Plotter and saves and loads
+the result, so hours of acquisition take seconds to minutes. It needs
+PyQt5, the plot is drawn offscreen.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import types
+import warnings
+import numpy as _np
+
+from eden import analysis as _ana
+from eden import clock as _clock
+from eden import loader as _loader
+from eden import session_file as _sf
+
+
+def _legacy_load(filename, file_format):
+    """Read a file the way the code did before eden.loader existed"""
+    if file_format == "gui":
+        # np.loadtxt for the data plus a second pass over the header
+        data = _np.loadtxt(filename, ndmin=2)
+        with open(filename, "r") as f_in:
+            for this_line in f_in:
+                if not this_line.startswith("#"):
+                    break
+        return data
+    if file_format == "labview":
+        return _np.loadtxt(filename, skiprows=3, ndmin=2)
+    return _np.loadtxt(filename, ndmin=2)
+
+
+def best_time(func, repeat):
+    """Shortest wall time of repeat calls of func"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_loader(directory, repeat=3):
+    """Load every file of directory with eden.loader and with np.loadtxt"""
+    filenames = _loader.list_files(directory)
+    formats = {}
+    n_rows = 0
+    for filename in filenames:
+        data, meta = _loader.load(filename)
+        formats[filename] = meta["format"]
+        n_rows += data.shape[0]
+
+    def load_all():
+        for filename in filenames:
+            _loader.load(filename)
+
+    def loadtxt_all():
+        with warnings.catch_warnings():
+            # empty files
+            warnings.simplefilter("ignore", UserWarning)
+            for filename in filenames:
+                if formats[filename] not in ("session", "journal"):
+                    _legacy_load(filename, formats[filename])
+
+    loader_time = best_time(load_all, repeat)
+    loadtxt_time = best_time(loadtxt_all, repeat)
+    return {"benchmark": "loader",
+            "n_files": len(filenames),
+            "n_rows": n_rows,
+            "loader_s": loader_time,
+            "loadtxt_s": loadtxt_time,
+            "speedup": loadtxt_time / loader_time}
+
+
+def _legacy_cumulative_charge(current):
+    """The per-row loop the analysis script used before eden.analysis"""
+    integral_charge = _np.zeros_like(current[:,1])
+    for i in range(current.shape[0]-1):
+        integral_charge[i+1] = current[i,1]*(current[i+1,0] - current[i,0]) + integral_charge[i]
+    return integral_charge
+
+
+def bench_charge(directory, n_files=5, repeat=3):
+    """Cumulative charge of the largest files: per-row loop vs. eden.analysis"""
+    filenames = sorted(_loader.list_files(directory), key=os.path.getsize)[-n_files:]
+    results = []
+    for filename in filenames:
+        data = _np.ascontiguousarray(_loader.load(filename)[0])
+        loop_time = best_time(lambda: _legacy_cumulative_charge(data), repeat)
+        vectorized_time = best_time(lambda: _ana.cumulative_charge(data[:, 0], data[:, 1]), repeat)
+        results.append({"file": filename,
+                        "n_rows": data.shape[0],
+                        "loop_s": loop_time,
+                        "vectorized_s": vectorized_time,
+                        "speedup": loop_time / vectorized_time})
+    return {"benchmark": "charge", "files": results}
+
+
+def _time_summary(seconds):
+    """Mean, median, 99th percentile and maximum of durations (s)"""
+    seconds = _np.asarray(seconds)
+    if not len(seconds):
+        return None
+    return {"n": len(seconds),
+            "mean_s": float(seconds.mean()),
+            "p50_s": float(_np.percentile(seconds, 50)),
+            "p99_s": float(_np.percentile(seconds, 99)),
+            "max_s": float(seconds.max()),
+            "last_s": float(seconds[-1])}
+
+
+def bench_acquisition(hours, n_channels=1, sample_interval=None, plot_interval=60., seed=0):
+    """Record hours of a simulated board through PscReader and the Plotter"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5 import QtWidgets as _qw
+    from eden import Class_PSC as _psc
+    from eden import deposition as _dep
+    from eden import threads as _threads
+
+    app = _qw.QApplication.instance() or _qw.QApplication([])
+    _clock.use(_clock.VirtualClock())
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # the reader journals to the working directory
+        os.chdir(directory)
+        try:
+            channels = list(range(1, n_channels+1))
+            psc = _psc.PSC("sim://benchmark?virtual=1&seed="+str(seed), channels[0], channels[1:])
+            psc.establish_connection()
+            psc.activate_chan()
+            reader = _threads.PscReader(psc)
+            reader.sample_interval = sample_interval
+            reader.sample_info = _sf.metadata(1.)
+            for channel in channels:
+                reader.set_setpoints(5., 2., channel)
+            gui = types.SimpleNamespace(data=reader.reader_data.view(), channel_data={},
+                                        total_charge=None, channel_charges={}, sample_area=1.,
+                                        deposition=_dep.DepositionTracker(),
+                                        sample_name="benchmark", coating_step="")
+            plotter = _threads.Plotter(gui)
+
+            reader.is_recording = True
+            start = _clock.now()
+            end = start + hours * 3600.
+            next_plot = start + plot_interval
+            next_checkpoint = start + 3600.
+            poll_times = []
+            plot_times = []
+            buffer_bytes = [reader.reader_data.capacity * reader.reader_data.n_columns * 8]
+            wall_start = time.perf_counter()
+            while _clock.now() < end:
+                poll_start = time.perf_counter()
+                measured = reader.poll()
+                if measured:
+                    poll_times.append((time.perf_counter() - poll_start) / len(measured))
+                if _clock.now() >= next_plot:
+                    # what MainWindow.update_overview hands over to the plotter
+                    gui.data = reader.reader_data.view()
+                    gui.channel_data = {channel: reader.channel_data[channel].view()
+                                        for channel in channels[1:]}
+                    gui.total_charge = reader.total_charge
+                    gui.channel_charges = {channel: reader.recorders[channel].charge
+                                           for channel in channels[1:]}
+                    plot_start = time.perf_counter()
+                    plotter.do_plot()
+                    app.processEvents()
+                    plot_times.append(time.perf_counter() - plot_start)
+                    next_plot += plot_interval
+                if _clock.now() >= next_checkpoint:
+                    buffer_bytes.append(reader.reader_data.capacity * reader.reader_data.n_columns * 8)
+                    next_checkpoint += 3600.
+            wall_time = time.perf_counter() - wall_start
+            reader.request_stop(True)
+            reader.run()
+            simulated = _clock.now() - start
+            counters = psc.telemetry.snapshot()["counters"]
+
+            data = reader.reader_data.view()
+            filename = os.path.join(directory, "benchmark"+_sf.EXTENSION)
+            save_time = best_time(lambda: _sf.save(filename, data, 1., "benchmark", "",
+                                                   reader.total_charge), 1)
+            load_time = best_time(lambda: _loader.load(filename), 1)
+            file_bytes = os.path.getsize(filename)
+        finally:
+            os.chdir(cwd)
+            _clock.use(None)
+
+    n_samples = sum(len(buffer) for buffer in reader.channel_data.values())
+    return {"hours": hours,
+            "n_channels": n_channels,
+            "sample_interval_s": sample_interval,
+            "n_samples": n_samples,
+            "simulated_s": simulated,
+            "samples_per_s": n_samples / simulated,
+            "wall_s": wall_time,
+            "wall_samples_per_s": n_samples / wall_time,
+            "sample_latency": _time_summary(poll_times),
+            "reader_data_rows": len(data),
+            "reader_data_bytes_hourly": buffer_bytes,
+            "plot_refresh": _time_summary(plot_times),
+            "save_s": save_time,
+            "load_s": load_time,
+            "file_bytes": file_bytes,
+            "link_errors": counters}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the EDen hot paths")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    loader_parser = subparsers.add_parser("loader", help="load the data archive")
+    loader_parser.add_argument("directory", nargs="?", default="data")
+    charge_parser = subparsers.add_parser("charge", help="integrate the charge of the largest files")
+    charge_parser.add_argument("directory", nargs="?", default="data")
+    charge_parser.add_argument("--files", type=int, default=5, help="number of files")
+    acquisition_parser = subparsers.add_parser("acquisition", help="record simulated runs")
+    acquisition_parser.add_argument("--hours", type=float, nargs="+", default=[1, 6, 24],
+                                    help="simulated run lengths (h)")
+    acquisition_parser.add_argument("--channels", type=int, default=1, help="number of channels")
+    acquisition_parser.add_argument("--interval", type=float, default=None,
+                                    help="poll interval (s), default: as fast as possible")
+    acquisition_parser.add_argument("--plot-interval", type=float, default=60.,
+                                    help="simulated seconds between plot refreshes")
+    acquisition_parser.add_argument("--seed", type=int, default=0, help="seed of the simulated board")
+    parser.add_argument("--repeat", type=int, default=3, help="take the best of this many runs")
+    args = parser.parse_args()
+
+    if args.benchmark == "loader":
+        result = bench_loader(args.directory, args.repeat)
+    elif args.benchmark == "charge":
+        result = bench_charge(args.directory, args.files, args.repeat)
+    elif args.benchmark == "acquisition":
+        result = {"benchmark": "acquisition",
+                  "runs": [bench_acquisition(hours, args.channels, args.interval,
+                                             args.plot_interval, args.seed)
+                           for hours in args.hours]}
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
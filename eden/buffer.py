@@ -0,0 +1,72 @@
+"""
+Growable sample buffer used by the reader thread to store the measured data
+without copying the whole history on every new sample.
+"""
+
+import threading as _th
+import numpy as _np
+
+
+class SampleBuffer:
+    """Row buffer with amortized O(1) append.
+
+    The rows are stored in a preallocated 2D array whose capacity is doubled
+    whenever it runs full. Readers get read-only views of the valid prefix via
+    view(); these views stay valid after later appends since appends only
+    write behind the prefix and a grow allocates a new array.
+    """
+
+    def __init__(self, n_columns=3, capacity=4096, dtype=_np.float64):
+        self.n_columns = n_columns
+        self.dtype = dtype
+        self.initial_capacity = max(int(capacity), 1)
+        self._lock = _th.Lock()
+        self._data = _np.empty((self.initial_capacity, n_columns), dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return self._data.shape[0]
+
+    def _grow(self, min_capacity):
+        new_capacity = self.capacity
+        while new_capacity < min_capacity:
+            new_capacity *= 2
+        new_data = _np.empty((new_capacity, self.n_columns), dtype=self.dtype)
+        new_data[:self._size] = self._data[:self._size]
+        self._data = new_data
+
+    def append(self, row):
+        """Append a single row (sequence of n_columns values)"""
+        with self._lock:
+            if self._size == self.capacity:
+                self._grow(self._size + 1)
+            self._data[self._size] = row
+            self._size += 1
+
+    def extend(self, rows):
+        """Append several rows at once (array-like of shape (n, n_columns))"""
+        rows = _np.asarray(rows, dtype=self.dtype).reshape((-1, self.n_columns))
+        with self._lock:
+            new_size = self._size + rows.shape[0]
+            if new_size > self.capacity:
+                self._grow(new_size)
+            self._data[self._size:new_size] = rows
+            self._size = new_size
+
+    def view(self):
+        """Read-only snapshot view of the rows stored so far (no copy)"""
+        with self._lock:
+            snapshot = self._data[:self._size]
+        snapshot = snapshot.view()
+        snapshot.flags.writeable = False
+        return snapshot
+
+    def clear(self):
+        """Drop all rows. Views handed out before stay untouched."""
+        with self._lock:
+            self._data = _np.empty((self.initial_capacity, self.n_columns), dtype=self.dtype)
+            self._size = 0
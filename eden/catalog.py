@@ -0,0 +1,177 @@
+"""
+SQLite index over the data archive.
+
+For every file of a data directory the catalog stores the sample name,
+coating step, sample surface, start and end time, number of samples, total
+charge and deposited mass. Entries are keyed by path and invalidated by
+modification time and size, so update() only loads new or changed files.
+Queries never touch the raw files.
+
+Usage:
+    python -m eden.catalog [data_dir] [--name NAME] [--step STEP]
+                           [--since YYYY-MM-DD] [--until YYYY-MM-DD]
+"""
+
+import argparse
+import datetime as _datetime
+import logging as _lg
+import os
+import sqlite3
+import numpy as _np
+
+from eden import analysis as _ana
+from eden import loader as _loader
+
+_cat_log = _lg.getLogger("eden.catalog")
+
+DEFAULT_NAME = ".eden_catalog.sqlite"
+FIELDS = ("path", "mtime", "size", "format", "sample_name", "coating_step",
+          "sample_surface", "start_time", "end_time", "n_rows", "total_charge", "mass")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    format TEXT,
+    sample_name TEXT,
+    coating_step TEXT,
+    sample_surface REAL,
+    start_time REAL,
+    end_time REAL,
+    n_rows INTEGER,
+    total_charge REAL,
+    mass REAL
+);
+CREATE INDEX IF NOT EXISTS runs_sample_name ON runs (sample_name);
+CREATE INDEX IF NOT EXISTS runs_start_time ON runs (start_time);
+"""
+
+
+def summarize(filename):
+    """Catalog entry of a single file (without mtime and size)"""
+    data, meta = _loader.load(filename)
+    entry = {"path": os.path.abspath(filename),
+             "format": meta["format"],
+             "sample_name": meta["sample_name"],
+             "coating_step": meta["coating_step"],
+             "sample_surface": meta["sample_surface"],
+             "start_time": None,
+             "end_time": None,
+             "n_rows": int(data.shape[0]),
+             "total_charge": None,
+             "mass": None}
+    if data.shape[0]:
+        charge = meta["total_charge"]
+        if charge is None:
+            charge = float(_ana.total_charge(data[:, 0], data[:, 1]))
+        entry["start_time"] = float(data[0, 0])
+        entry["end_time"] = float(data[-1, 0])
+        if _np.isfinite(charge):
+            entry["total_charge"] = charge
+            entry["mass"] = float(_ana.deposited_mass(charge))
+    return entry
+
+
+class Catalog:
+    """Index of the runs in a data directory"""
+
+    def __init__(self, directory, db_filename=None):
+        self.directory = os.path.abspath(directory)
+        self.db_filename = db_filename or os.path.join(self.directory, DEFAULT_NAME)
+        self.conn = sqlite3.connect(self.db_filename)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def update(self):
+        """Index new and changed files, drop deleted ones.
+
+        Returns the number of (re)indexed and of removed entries.
+        """
+        known = {row["path"]: (row["mtime"], row["size"]) for row in
+                 self.conn.execute("SELECT path, mtime, size FROM runs")}
+        current = {}
+        for filename in _loader.list_files(self.directory):
+            stat = os.stat(filename)
+            current[os.path.abspath(filename)] = (stat.st_mtime, stat.st_size)
+
+        changed = [path for path, stamp in current.items() if known.get(path) != stamp]
+        removed = [path for path in known if path not in current]
+        with self.conn:
+            for path in changed:
+                try:
+                    entry = summarize(path)
+                except (OSError, ValueError) as err:
+                    # keep unreadable files out of the index, they get
+                    # retried once they change
+                    _cat_log.warning("Could not index %s: %s", path, err)
+                    continue
+                entry["mtime"], entry["size"] = current[path]
+                self.conn.execute("INSERT OR REPLACE INTO runs ("+", ".join(FIELDS)+") VALUES ("
+                                  + ", ".join("?"*len(FIELDS))+")",
+                                  [entry[field] for field in FIELDS])
+            self.conn.executemany("DELETE FROM runs WHERE path = ?", [(path,) for path in removed])
+        return len(changed), len(removed)
+
+    def query(self, sample_name=None, coating_step=None, since=None, until=None):
+        """Entries as dicts, ordered by start time.
+
+        sample_name matches as a substring, since and until are UNIX times
+        bounding the start time of the run.
+        """
+        conditions = []
+        parameters = []
+        if sample_name:
+            conditions.append("sample_name LIKE ?")
+            parameters.append("%"+sample_name+"%")
+        if coating_step:
+            conditions.append("coating_step = ?")
+            parameters.append(coating_step)
+        if since is not None:
+            conditions.append("start_time >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("start_time < ?")
+            parameters.append(until)
+        sql = "SELECT * FROM runs"
+        if conditions:
+            sql += " WHERE "+" AND ".join(conditions)
+        sql += " ORDER BY start_time"
+        return [dict(row) for row in self.conn.execute(sql, parameters)]
+
+
+def format_time(timestamp):
+    if timestamp is None:
+        return "-"
+    return _datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _parse_date(text):
+    return _datetime.datetime.strptime(text, "%Y-%m-%d").timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index and query the EDen data archive")
+    parser.add_argument("directory", nargs="?", default="data")
+    parser.add_argument("--name", default=None, help="part of the sample name")
+    parser.add_argument("--step", default=None, help="coating step")
+    parser.add_argument("--since", type=_parse_date, default=None, help="first day (YYYY-MM-DD)")
+    parser.add_argument("--until", type=_parse_date, default=None, help="day after the last one (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    catalog = Catalog(args.directory)
+    n_changed, n_removed = catalog.update()
+    print("indexed "+str(n_changed)+" files, removed "+str(n_removed))
+    for entry in catalog.query(args.name, args.step, args.since, args.until):
+        mass = "-" if entry["mass"] is None else "%.4f mg" % (entry["mass"]*1E3)
+        print("\t".join((format_time(entry["start_time"]), entry["sample_name"] or "-",
+                         entry["coating_step"] or "-", str(entry["n_rows"]), mass,
+                         os.path.basename(entry["path"]))))
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Shared clock for the sample timestamps.
+
+time.time() may jump when the system clock gets adjusted. now() is UNIX
+time anchored once when the module is imported and advanced with the
+monotonic, high resolution performance counter, so all boards and channels
+read in this process are timestamped on one steady timebase.
+
+For simulations the clock can be replaced by a VirtualClock (use()), which
+only advances when the acquisition waits on it with sleep(), so simulated
+hours run as fast as the CPU allows.
+"""
+
+import threading as _th
+import time
+
+_ANCHOR_WALL = time.time()
+_ANCHOR_COUNTER = time.perf_counter()
+_source = None
+
+
+class VirtualClock:
+    """Clock that advances by the time slept on it instead of waiting"""
+
+    def __init__(self, start=None):
+        self._lock = _th.Lock()
+        self.time = time.time() if start is None else start
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.time += max(seconds, 0.)
+
+
+def now():
+    """Seconds since the epoch on the shared timebase"""
+    if _source is not None:
+        return _source.now()
+    return _ANCHOR_WALL + (time.perf_counter() - _ANCHOR_COUNTER)
+
+
+def sleep(seconds):
+    """Wait on the shared timebase"""
+    if _source is not None:
+        _source.sleep(seconds)
+    elif seconds > 0:
+        time.sleep(seconds)
+
+
+def use(source):
+    """Take the time from source (e.g. a VirtualClock), None for the real clock"""
+    global _source
+    _source = source
+
+
+def source():
+    """The replacement clock in use, None for the real clock"""
+    return _source
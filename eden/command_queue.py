@@ -0,0 +1,88 @@
+"""
+Priority queue of commands for the thread owning the serial port.
+
+Other threads never touch the port, they submit callables which the owner
+runs between two measurements and get a concurrent.futures.Future back.
+Commands with a lower priority value run first, commands of equal priority
+in submission order. A command submitted with a key supersedes a still
+pending command with the same key, e.g. an older voltage setpoint, whose
+future gets cancelled.
+"""
+
+import concurrent.futures as _futures
+import heapq
+import itertools
+import threading as _th
+
+# priorities, lower values run first
+SETPOINT = 0
+CONTROL = 1
+QUERY = 2
+
+
+class CommandQueue:
+
+    def __init__(self):
+        self._lock = _th.Lock()
+        self._heap = []
+        self._counter = itertools.count()
+        # pending entries by key, for coalescing
+        self._keyed = {}
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for entry in self._heap if entry[2] is not None)
+
+    def submit(self, func, *args, priority=CONTROL, key=None):
+        """Queue func(*args), returns a Future with its result"""
+        future = _futures.Future()
+        with self._lock:
+            if key is not None:
+                superseded = self._keyed.pop(key, None)
+                if superseded is not None:
+                    superseded[2] = None
+                    superseded[4].cancel()
+            entry = [priority, next(self._counter), func, args, future, key]
+            heapq.heappush(self._heap, entry)
+            if key is not None:
+                self._keyed[key] = entry
+        return future
+
+    def _pop(self):
+        with self._lock:
+            while self._heap:
+                entry = heapq.heappop(self._heap)
+                if entry[2] is None:
+                    continue
+                if entry[5] is not None and self._keyed.get(entry[5]) is entry:
+                    del self._keyed[entry[5]]
+                return entry
+        return None
+
+    def run_pending(self):
+        """Run all queued commands in priority order (owner thread only).
+
+        Returns the number of commands run.
+        """
+        n_run = 0
+        while True:
+            entry = self._pop()
+            if entry is None:
+                return n_run
+            _, _, func, args, future, _ = entry
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args))
+            except Exception as err:
+                future.set_exception(err)
+            n_run += 1
+
+    def cancel_all(self):
+        """Drop all pending commands and cancel their futures"""
+        with self._lock:
+            entries, self._heap = self._heap, []
+            self._keyed.clear()
+        for entry in entries:
+            if entry[2] is not None:
+                entry[4].cancel()
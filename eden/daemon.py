@@ -0,0 +1,500 @@
+"""
+Headless acquisition daemon.
+
+Runs connection, polling, recording and autosave of one PSC without Qt, so
+a long run goes on whatever happens to a GUI. The settings come from the
+command line or from a JSON file (--config) holding the same names
+(e.g. {"channels": "1,2", "interval": 0.5}), the command line wins.
+
+Usage:
+    python -m eden.daemon PORT [--channels 1,2] [--config FILE] [--record]
+                          [--surface CM2] [--name NAME] [--step STEP]
+                          [--interval S] [--deadband-voltage V]
+                          [--deadband-current A] [--max-interval S]
+                          [--align-voltage] [--voltage V --current A]
+                          [--target-charge C | --target-mass MG | --target-thickness NM]
+                          [--program FILE [--program-channel N]]
+                          [--output DIR] [--autosave S] [--listen HOST:PORT]
+                          [--stream tcp:HOST:PORT | unix:PATH] [--duration S]
+
+While recording, the data is saved every --autosave seconds (and when the
+recording ends) to <output>/<start>[_<name>][_<step>].eden, the other
+channels to ..._ch<n>.eden, as the GUI saves them. With a target the
+output is zeroed and the recording ends once the charge reaches it (see
+eden.target), a thickness target needs --surface. A setpoint program
+(see eden.program) runs from the start with --program; the setpoints
+written are saved with the recording to <...>.setpoints.json, the target
+and its stop latency to <...>.target.json. The daemon logs to stderr.
+
+The daemon answers JSON requests, one per line, on a local TCP port. The
+GUI attaches to it as viewer and controller when connected to the port
+eden://HOST:PORT, scripts use Client. The requests are
+    {"command": "status"}
+    {"command": "samples", "channel": 1, "start": 0}
+    {"command": "setpoints", "voltage": 5.0, "current": 1.0, "channel": 1}
+    {"command": "record", "sample_info": {...}, "sample_interval": null,
+     "deadband": null, "align_voltage": false, "target": {"mass": 0.01}}
+    {"command": "stop_recording"}
+    {"command": "program", "segments": [...], "channel": 1}
+    {"command": "stop_program"}
+    {"command": "telemetry"}
+    {"command": "shutdown"}
+and every reply holds "ok", and "error" if the request failed.
+
+With --stream the stored samples are also published live as binary frames
+to any number of subscribers, see eden.stream.
+"""
+
+import argparse
+import json
+import logging as _lg
+import os
+import socket
+import socketserver
+import threading as _th
+import time
+
+from eden import Class_PSC as _psc
+from eden import acquisition as _acq
+from eden import clock as _clock
+from eden import program as _prg
+from eden import session_file as _sf
+from eden import stream as _stream
+from eden import target as _tgt
+from eden import telemetry as _tel
+
+_dmn_log = _lg.getLogger("eden.daemon")
+
+SCHEME = "eden://"
+DEFAULT_ADDRESS = ("127.0.0.1", 7520)
+# most rows in the reply to a samples request
+MAX_ROWS = 10000
+# seconds a request waits for its command on the acquisition thread
+COMMAND_TIMEOUT = 10.
+
+
+class DaemonError(RuntimeError):
+    """A request the daemon refused or failed to carry out"""
+
+
+def parse_address(text):
+    """(host, port) of HOST:PORT or eden://HOST:PORT"""
+    if text.startswith(SCHEME):
+        text = text[len(SCHEME):]
+    host, _, port = text.rpartition(":")
+    return (host or DEFAULT_ADDRESS[0], int(port))
+
+
+class Daemon:
+    """Recording, autosave and remote control of an Acquisition"""
+
+    def __init__(self, acquisition, output=".", autosave_interval=60.):
+        self.acquisition = acquisition
+        self.output = output
+        self.autosave_interval = autosave_interval
+        self.filename_root = None
+        # counts the recordings, each one starts with empty buffers
+        self.generation = 0
+        # the closed recording is saved
+        self.saved = True
+        self.server = None
+        self.stream = None
+        self._lock = _th.RLock()
+        self._stop = _th.Event()
+        self._last_save = time.monotonic()
+        # commands queued without a request waiting for them, e.g. --program
+        acquisition.failure_callbacks.append(lambda message: _dmn_log.error("Command failed: %s", message))
+        self.requests = {"status": self.status,
+                         "samples": self.samples,
+                         "setpoints": self.setpoints,
+                         "record": self.start_recording,
+                         "stop_recording": self.stop_recording,
+                         "program": self.start_program,
+                         "stop_program": self.stop_program,
+                         "telemetry": self.telemetry,
+                         "shutdown": self.shutdown}
+
+    def start_recording(self, sample_info=None, sample_interval=None, deadband=None,
+                        align_voltage=False, target=None):
+        """Start a recording, target is e.g. {"thickness": cm}, see eden.target"""
+        acquisition = self.acquisition
+        if acquisition.recording_open:
+            raise DaemonError("A recording is running")
+        sample_info = dict(_sf.metadata(), **(sample_info or {}))
+        if target:
+            (kind, value), = target.items()
+            try:
+                target = _tgt.TargetStop(_tgt.target_charge(kind, float(value),
+                                                            sample_info["sample_surface"]))
+            except ValueError as error:
+                raise DaemonError(str(error))
+        with self._lock:
+            self.finish_recording()
+            for buffer in acquisition.channel_data.values():
+                buffer.clear()
+            self.generation += 1
+            self.saved = False
+        acquisition.sample_info = sample_info
+        acquisition.sample_interval = sample_interval
+        acquisition.deadband = tuple(deadband) if deadband else None
+        acquisition.align_voltage = bool(align_voltage)
+        acquisition.recorders = {}
+        acquisition.target = target or None
+        acquisition.psc.telemetry.reset()
+        acquisition.setpoint_log.reset()
+        name = time.strftime("%Y%m%d_%H%M%S", time.gmtime())
+        for part in (sample_info["sample_name"], sample_info["coating_step"]):
+            if part:
+                name += "_"+part
+        self.filename_root = os.path.join(self.output, name)
+        self._last_save = time.monotonic()
+        acquisition.is_recording = True
+        return {"filename_root": self.filename_root}
+
+    def stop_recording(self):
+        self.acquisition.is_recording = False
+        return {}
+
+    def start_program(self, segments, channel=None):
+        try:
+            self.acquisition.start_program(segments, channel).result(COMMAND_TIMEOUT)
+        except (ValueError, TypeError, KeyError) as error:
+            raise DaemonError("Invalid program: "+str(error))
+        return {}
+
+    def stop_program(self):
+        self.acquisition.stop_program().result(COMMAND_TIMEOUT)
+        return {}
+
+    def finish_recording(self):
+        """Save the closed recording unless done already"""
+        with self._lock:
+            if not self.saved and not self.acquisition.recording_open:
+                self.save()
+                self.saved = True
+
+    def save(self):
+        """Save the recorded data of every channel and the telemetry"""
+        with self._lock:
+            acquisition = self.acquisition
+            info = acquisition.sample_info
+            for channel, buffer in acquisition.channel_data.items():
+                filename = self.filename_root
+                if channel != acquisition.psc.channel:
+                    filename += "_ch"+str(channel)
+                recorder = acquisition.recorders.get(channel)
+                # a crash while saving leaves the previous file intact (see _sf.save)
+                _sf.save(filename+_sf.EXTENSION, buffer.view(), info["sample_surface"],
+                         info["sample_name"], info["coating_step"],
+                         None if recorder is None else recorder.charge)
+            acquisition.psc.telemetry.export(self.filename_root+_tel.EXTENSION,
+                                             port=acquisition.psc.port,
+                                             channels=acquisition.psc.channels,
+                                             session=self.filename_root+_sf.EXTENSION)
+            program = acquisition.program
+            acquisition.setpoint_log.export(self.filename_root+_prg.EXTENSION,
+                                            session=self.filename_root+_sf.EXTENSION,
+                                            program=None if program is None else program.summary(),
+                                            segments=None if program is None else program.segments)
+            if acquisition.target is not None:
+                acquisition.target.export(self.filename_root+_tgt.EXTENSION,
+                                          session=self.filename_root+_sf.EXTENSION)
+            self._last_save = time.monotonic()
+
+    def status(self):
+        acquisition = self.acquisition
+        psc = acquisition.psc
+        return {"port": psc.port,
+                "channel": psc.channel,
+                "channels": psc.channels,
+                "recording": acquisition.is_recording,
+                "recording_open": acquisition.recording_open,
+                "generation": self.generation,
+                "filename_root": self.filename_root,
+                "sample_info": acquisition.sample_info,
+                "n_rows": {channel: len(buffer) for channel, buffer
+                           in acquisition.channel_data.items()},
+                "charges": {channel: recorder.charge for channel, recorder
+                            in acquisition.recorders.items()},
+                "target": None if acquisition.target is None else acquisition.target.summary(),
+                "program": None if acquisition.program is None else acquisition.program.summary(),
+                "setpoints": acquisition.setpoint_log.summary(),
+                "readings": psc.readings,
+                "telemetry": psc.telemetry.status_text(),
+                "stream": None if self.stream is None else self.stream.address,
+                "subscribers": [] if self.stream is None else self.stream.stats()}
+
+    def samples(self, channel, start=0, max_rows=MAX_ROWS):
+        data = self.acquisition.channel_data[int(channel)].view()
+        return {"generation": self.generation,
+                "start": start,
+                "n_rows": len(data),
+                "rows": data[start:start+min(max_rows, MAX_ROWS)].tolist()}
+
+    def setpoints(self, voltage, current, channel=None):
+        future = self.acquisition.set_setpoints(float(voltage), float(current), channel)
+        future.result(COMMAND_TIMEOUT)
+        return {}
+
+    def telemetry(self):
+        return {"telemetry": self.acquisition.psc.telemetry.snapshot()}
+
+    def shutdown(self):
+        self._stop.set()
+        return {}
+
+    def handle(self, request):
+        """Reply (dict) to a request (dict)"""
+        arguments = dict(request)
+        command = arguments.pop("command", None)
+        if command not in self.requests:
+            return {"ok": False, "error": "Unknown command "+str(command)}
+        try:
+            reply = self.requests[command](**arguments)
+        except Exception as error:
+            # whatever went wrong, the daemon keeps running
+            return {"ok": False, "error": type(error).__name__+": "+str(error)}
+        reply["ok"] = True
+        return reply
+
+    def listen(self, address=DEFAULT_ADDRESS):
+        """Serve requests on address in the background"""
+        self.server = _Server(address, _Handler)
+        self.server.daemon = self
+        _th.Thread(target=self.server.serve_forever, name="eden.daemon server",
+                   daemon=True).start()
+
+    def publish(self, address=_stream.DEFAULT_ADDRESS, max_queued=_stream.MAX_QUEUED):
+        """Stream the stored samples to the subscribers of address"""
+        self.stream = _stream.StreamServer(address, max_queued)
+        self.acquisition.publishers.append(self.stream.publish)
+
+    def run(self, duration=None):
+        """Acquire until shutdown, Ctrl+C or for duration seconds"""
+        thread = _th.Thread(target=self.acquisition.run, name="eden.daemon acquisition")
+        thread.start()
+        start = _clock.now()
+        try:
+            while not self._stop.is_set() and thread.is_alive():
+                if duration is not None and _clock.now() - start >= duration:
+                    break
+                # the last samples are stored once the recording is closed
+                if not self.acquisition.recording_open:
+                    self.finish_recording()
+                elif time.monotonic() - self._last_save >= self.autosave_interval:
+                    self.save()
+                self._stop.wait(0.1)
+        except KeyboardInterrupt:
+            pass
+        self.acquisition.is_recording = False
+        self.acquisition.request_stop(close_connection=True)
+        thread.join()
+        self.finish_recording()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.stream is not None:
+            self.stream.close()
+
+
+class _Server(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                reply = self.server.daemon.handle(request)
+            except ValueError as error:
+                reply = {"ok": False, "error": "Invalid request: "+str(error)}
+            self.wfile.write(json.dumps(reply).encode()+b"\n")
+
+
+class Client:
+    """Requests to a daemon, safe to share between threads"""
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=COMMAND_TIMEOUT+5.):
+        if isinstance(address, str):
+            address = parse_address(address)
+        self.address = address
+        self._socket = socket.create_connection(address, timeout)
+        self._file = self._socket.makefile("rwb")
+        self._lock = _th.Lock()
+
+    def request(self, command, **arguments):
+        """The reply to a request, raises DaemonError if it failed"""
+        arguments["command"] = command
+        with self._lock:
+            self._file.write(json.dumps(arguments).encode()+b"\n")
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise DaemonError("The daemon closed the connection")
+        reply = json.loads(line)
+        if not reply.pop("ok"):
+            raise DaemonError(reply["error"])
+        return reply
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+class RemoteTelemetry:
+    """Telemetry of the board of a daemon, as far as the GUI uses it"""
+
+    def __init__(self, client):
+        self.client = client
+        self.text = ""
+
+    def status_text(self):
+        return self.text
+
+    def reset(self):
+        # the daemon resets it when a recording starts
+        pass
+
+    def export(self, filename, **info):
+        snapshot = self.client.request("telemetry")["telemetry"]
+        snapshot.update(info)
+        with open(filename, "w") as f_out:
+            json.dump(snapshot, f_out, indent=2)
+
+
+class RemotePSC:
+    """Stand-in for the PSC of a daemon, for the GUI as viewer and controller"""
+
+    def __init__(self, port):
+        self.port = port
+        self.client = Client(port)
+        status = self.client.request("status")
+        self.channel = status["channel"]
+        self.channels = status["channels"]
+        self.telemetry = RemoteTelemetry(self.client)
+        self.reader_thread = None
+        self.mea_vol = float('nan')
+        self.mea_cu = float('nan')
+        self.is_connected = True
+        self.update(status)
+
+    def update(self, status):
+        """Take the readings and telemetry of a status reply"""
+        self.mea_vol, self.mea_cu = status["readings"].get(str(self.channel),
+                                                           (self.mea_vol, self.mea_cu))
+        self.telemetry.text = status["telemetry"]
+
+    def set_readerthread(self, thread):
+        self.reader_thread = thread
+
+    def close_connection(self):
+        # the daemon and its measurement go on
+        self.client.close()
+        self.is_connected = False
+
+
+def load_config(filename):
+    """Settings of a JSON config file, with the option names of the command line"""
+    with open(filename) as f_in:
+        config = json.load(f_in)
+    return {key.replace("-", "_"): value for key, value in config.items()}
+
+
+def connect(port, channels):
+
+    psc = _psc.PSC(port, channels[0], channels[1:])
+    psc.establish_connection()
+    psc.activate_chan()
+    return psc
+
+
+def main():
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument("--config", default=None, help="JSON file with the settings")
+    config_args, _ = config_parser.parse_known_args()
+
+    parser = argparse.ArgumentParser(description="Record a PSC without the GUI",
+                                     parents=[config_parser])
+    parser.add_argument("port", nargs="?", default=None, help="serial port, e.g. COM3 or sim://A")
+    parser.add_argument("--channels", default="1", help="board channels, e.g. 1,2")
+    parser.add_argument("--record", action="store_true", help="record from the start")
+    parser.add_argument("--surface", type=float, default=None, help="sample surface (cm^2)")
+    parser.add_argument("--name", default="", help="sample name")
+    parser.add_argument("--step", default="", help="coating step")
+    parser.add_argument("--interval", type=float, default=None,
+                        help="poll interval (s), default: as fast as possible")
+    parser.add_argument("--deadband-voltage", type=float, default=None,
+                        help="store a sample when the voltage changed by more (V)")
+    parser.add_argument("--deadband-current", type=float, default=None,
+                        help="store a sample when the current changed by more (A)")
+    parser.add_argument("--max-interval", type=float, default=None,
+                        help="store a sample at least this often (s)")
+    parser.add_argument("--align-voltage", action="store_true",
+                        help="interpolate the voltage to the time of the current")
+    parser.add_argument("--voltage", type=float, default=None, help="voltage setpoint (V)")
+    parser.add_argument("--current", type=float, default=None, help="current setpoint (A)")
+    parser.add_argument("--target-charge", type=float, default=None,
+                        help="stop at this charge (C)")
+    parser.add_argument("--target-mass", type=float, default=None,
+                        help="stop at this deposited mass (mg)")
+    parser.add_argument("--target-thickness", type=float, default=None,
+                        help="stop at this layer thickness (nm), needs --surface")
+    parser.add_argument("--program", default=None, help="JSON setpoint program to run")
+    parser.add_argument("--program-channel", type=int, default=None,
+                        help="channel of the program (default: the first one)")
+    parser.add_argument("--output", default=".", help="directory of the saved sessions")
+    parser.add_argument("--autosave", type=float, default=60., help="autosave interval (s)")
+    parser.add_argument("--listen", default="%s:%d" % DEFAULT_ADDRESS,
+                        help="HOST:PORT of the requests, 'none' to not listen")
+    parser.add_argument("--stream", default=None,
+                        help="publish the samples live to tcp:HOST:PORT or unix:PATH")
+    parser.add_argument("--duration", type=float, default=None, help="seconds (default: until shutdown)")
+    if config_args.config:
+        parser.set_defaults(**load_config(config_args.config))
+    args = parser.parse_args()
+    if args.port is None:
+        parser.error("no port given")
+    # the target stops and the programs are reported at INFO
+    _lg.basicConfig(level=_lg.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+    channels = args.channels
+    if not isinstance(channels, list):
+        channels = [int(channel) for channel in str(channels).split(",")]
+    acquisition = _acq.Acquisition(connect(args.port, channels))
+    daemon = Daemon(acquisition, args.output, args.autosave)
+    if args.voltage is not None and args.current is not None:
+        for channel in channels:
+            acquisition.set_setpoints(args.voltage, args.current, channel)
+    if args.record:
+        deadband = (args.deadband_voltage, args.deadband_current, args.max_interval)
+        # the GUI units, converted to the ones of eden.analysis
+        targets = {"charge": args.target_charge,
+                   "mass": None if args.target_mass is None else args.target_mass*1E-3,
+                   "thickness": None if args.target_thickness is None else args.target_thickness*1E-7}
+        targets = {kind: value for kind, value in targets.items() if value is not None}
+        if len(targets) > 1:
+            parser.error("only one target can be given")
+        try:
+            daemon.start_recording(_sf.metadata(args.surface, args.name, args.step), args.interval,
+                                   None if deadband == (None, None, None) else deadband,
+                                   args.align_voltage, targets)
+        except DaemonError as error:
+            parser.error(str(error))
+    if args.program:
+        try:
+            acquisition.start_program(_prg.load(args.program), args.program_channel)
+        except (OSError, ValueError, TypeError, KeyError) as error:
+            parser.error("invalid program: "+str(error))
+    if args.stream:
+        daemon.publish(args.stream)
+    if args.listen.lower() != "none":
+        daemon.listen(parse_address(args.listen))
+    daemon.run(args.duration)
+
+
+if __name__ == "__main__":
+    main()
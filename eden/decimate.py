@@ -0,0 +1,92 @@
+"""
+Level-of-detail reduction of long time series for plotting. A canvas can
+show only about one value per pixel column, so only the minimum and maximum
+of the samples falling into each column are handed to matplotlib. Spikes
+stay visible this way.
+"""
+
+import numpy as _np
+
+
+def minmax_decimate(x, y, n_buckets):
+    """Reduce (x, y) to the min and max of y in n_buckets consecutive buckets.
+
+    x is expected to be sorted. The first and the last point are always kept
+    and the returned points keep their original order. Series with less than
+    2*n_buckets points are returned unchanged.
+    """
+    x = _np.asarray(x)
+    y = _np.asarray(y)
+    n_points = y.shape[0]
+    n_buckets = int(n_buckets)
+    if n_buckets < 1 or n_points <= 2*n_buckets:
+        return x, y
+
+    bucket_size = n_points // n_buckets
+    n_full = bucket_size * n_buckets
+    buckets = y[:n_full].reshape((n_buckets, bucket_size))
+    offsets = _np.arange(n_buckets) * bucket_size
+    extremes = _np.stack((buckets.argmin(axis=1) + offsets,
+                          buckets.argmax(axis=1) + offsets), axis=1)
+    index = [[0], _np.sort(extremes, axis=1).ravel()]
+    # the few points behind the last full bucket
+    if n_full < n_points:
+        tail = y[n_full:]
+        index.append(_np.sort((n_full + tail.argmin(), n_full + tail.argmax())))
+    index.append([n_points - 1])
+    index = _np.unique(_np.concatenate(index))
+    return x[index], y[index]
+
+
+def visible_slice(x, x_min, x_max):
+    """Index slice of the sorted x covering [x_min, x_max], plus one point
+    on each side so the line runs up to the edges of the axes"""
+    start = max(_np.searchsorted(x, x_min, side='left') - 1, 0)
+    stop = min(_np.searchsorted(x, x_max, side='right') + 1, len(x))
+    return slice(start, stop)
+
+
+class DecimatedLine:
+    """Feeds a matplotlib line with a min/max decimated copy of its data.
+
+    The data is decimated to one bucket per pixel column of the axes. When
+    the x limits change (zoom or pan with the navigation toolbar, rescaling)
+    the visible range is decimated again from the full resolution data.
+    """
+
+    def __init__(self, line):
+        self.line = line
+        self.axes = line.axes
+        self.x = _np.empty(0)
+        self.y = _np.empty(0)
+        # twinned axes share the x limits, but only the axes that was zoomed
+        # or panned emits the callback
+        for axes in self.axes.get_shared_x_axes().get_siblings(self.axes):
+            axes.callbacks.connect('xlim_changed', self.on_xlim_changed)
+
+    def n_buckets(self):
+
+        return max(int(self.axes.bbox.width), 1)
+
+    def set_data(self, x, y):
+
+        self.x = _np.asarray(x)
+        self.y = _np.asarray(y)
+        self.redecimate()
+        if self.axes.get_autoscalex_on() or self.axes.get_autoscaley_on():
+            self.axes.relim()
+            self.axes.autoscale_view()
+
+    def redecimate(self):
+
+        x, y = self.x, self.y
+        # with autoscaling the whole series will be visible, otherwise only
+        # the part within the current limits has to be decimated
+        if not self.axes.get_autoscalex_on() and len(x):
+            visible = visible_slice(x, *sorted(self.axes.get_xlim()))
+            x, y = x[visible], y[visible]
+        self.line.set_data(*minmax_decimate(x, y, self.n_buckets()))
+
+    def on_xlim_changed(self, axes):
+
+        self.redecimate()
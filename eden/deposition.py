@@ -0,0 +1,92 @@
+"""
+Derived quantities of a running coating: deposited charge, copper mass,
+layer thickness and current density, computed with the functions of
+eden.analysis.
+"""
+
+import threading as _th
+import numpy as _np
+
+from eden import analysis as _ana
+from eden import buffer as _buf
+
+
+class DepositionTracker:
+    """Incrementally updated charge, mass, thickness and current density.
+
+    update() is given the (time, current, voltage) array of the measurement
+    and only integrates the rows appended since the last call, so a refresh
+    costs O(new samples). The results are cached until more data arrives.
+    If the data does not continue the one seen before (cleared, loaded from
+    file, ...) the tracker starts over, while an older snapshot of the same
+    measurement is ignored. If the exact charge of the run is known (see
+    eden.recording) it replaces the integral of the rows.
+    """
+
+    def __init__(self):
+        self._lock = _th.Lock()
+        self._reset()
+
+    def reset(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self.surface = None
+        self.charge = 0.
+        self.mass = 0.
+        self.thickness = None
+        self._row_charge = 0.
+        self._n_rows = 0
+        self._start_time = None
+        # relative time, current density and voltage of every processed row
+        self._series = _buf.SampleBuffer(n_columns=3)
+
+    @property
+    def n_rows(self):
+        return self._n_rows
+
+    def series(self):
+        """Time since the first sample (s), current density (mA/cm^2) and
+        voltage (V) of every sample, of equal length even while updated"""
+        with self._lock:
+            rows = self._series.view()
+        return rows[:, 0], rows[:, 1], rows[:, 2]
+
+    def update(self, data, surface, charge=None):
+        """Process the new rows of data, returns True if anything changed"""
+        with self._lock:
+            changed = self._update_rows(data, surface)
+            new_charge = self._row_charge if charge is None else charge
+            if new_charge != self.charge:
+                self.charge = new_charge
+                self.mass = _ana.deposited_mass(self.charge)
+                if self.surface:
+                    self.thickness = _ana.coating_thickness(self.mass, self.surface)
+                changed = True
+            return changed
+
+    def _update_rows(self, data, surface):
+        data = _np.asarray(data)
+        n_rows = data.shape[0] if data.ndim == 2 else 0
+        if (not n_rows or surface != self.surface
+                or (self._n_rows and data[0, 0] != self._start_time)):
+            self._reset()
+        if n_rows <= self._n_rows:
+            return False
+        if not self._n_rows:
+            self.surface = surface
+            self._start_time = data[0, 0]
+
+        # trapezoid integral of the new rows, joined to the last known one
+        new_rows = data[max(self._n_rows - 1, 0):n_rows]
+        self._row_charge += _ana.total_charge(new_rows[:, 0], new_rows[:, 1])
+
+        appended = data[self._n_rows:n_rows]
+        series = _np.empty((appended.shape[0], 3))
+        series[:, 0] = appended[:, 0] - self._start_time
+        series[:, 1] = _ana.current_density(appended[:, 1], surface) if surface else _np.nan
+        series[:, 2] = appended[:, 2]
+        self._series.extend(series)
+        self._n_rows = n_rows
+        return True
@@ -1,17 +1,86 @@
-import time
-from random import gauss
+"""
+Simulated PSC board behind a serial port.
+
+Serial stands in for serial.Serial. It understands the commands Class_PSC
+sends (CH, SO:VO, SO:CU, SO:VO:MA, SO:CU:MA, ME:VO?, ME:CU?, REM, LOC, SP
+and their queries) and keeps the setpoints of every channel. The timing
+follows the link: every byte takes (start + data + parity + stop bits) /
+baudrate on the wire, the board handles one command after the other and
+takes processing_time for each. A read waits for the reply or the timeout.
+
+With virtual=True the process clock (eden.clock) is replaced by a
+VirtualClock, the waits advance it instead of sleeping and a simulated
+hour runs as fast as the CPU allows. The clock before is restored once the
+last port on the virtual clock is closed. The noise of the measurements and the
+faults (garbled replies, replies that never come) are drawn from a seeded
+random generator, so a run is reproducible.
+
+The options can be given in the port name, e.g. Class_PSC connects to
+    sim://COM3?seed=1&virtual=1&noise=0.1&garble=0.01&timeouts=0.001
+"""
+
+import random
+import urllib.parse
+
+from eden import clock as _clock
 
 PARITY_NONE = None
+SCHEME = "sim://"
+TERMINATOR = b"\n\r\x04"
+# seconds the board takes for a command
+PROCESSING_TIME = 0.08
+# replaces a byte of a garbled reply
+GARBLE_BYTE = b"\x15"
+# options of a sim:// port and the Serial argument they set
+URL_OPTIONS = {"seed": ("seed", int), "virtual": ("virtual", lambda value: value not in ("0", "")),
+               "noise": ("noise", float), "processing": ("processing_time", float),
+               "garble": ("garble_rate", float), "timeouts": ("timeout_rate", float)}
+
+# open ports on the virtual clock, the VirtualClock installed for them (None
+# if it was in use already) and the clock in use before it
+_virtual_ports = []
+_installed = None
+_previous_source = None
+
+
+def parse_url(port, url_options=URL_OPTIONS):
+    """(name, {argument: value}) of a sim:// port"""
+    url = urllib.parse.urlsplit(port)
+    options = {}
+    for key, value in urllib.parse.parse_qsl(url.query, keep_blank_values=True):
+        if key not in url_options:
+            raise ValueError("Unknown simulator option "+key)
+        argument, convert = url_options[key]
+        options[argument] = convert(value)
+    return url.netloc + url.path, options
+
+
+class ChannelState:
+    """Setpoints and modes of one channel of the board"""
+
+    def __init__(self):
+        self.v_set = 0.
+        self.i_set = 0.
+        self.v_max = 0.
+        self.i_max = 0.
+        self.remote_cv = 1
+        self.remote_cc = 1
+        self.speed = 0
+
 
 class Serial:
 
     ## init(): the constructor.  Many of the arguments have default values
     # and can be skipped when calling the constructor.
-    
+
     def __init__( self, port='COM1', baudrate = 19200, timeout=1,
                   bytesize = 8, parity = 'N', stopbits = 1, xonxoff=0,
-                  rtscts = 0):
-                  
+                  rtscts = 0, seed=None, virtual=False, noise=0.1,
+                  processing_time=PROCESSING_TIME, garble_rate=0., timeout_rate=0.):
+
+        options = {}
+        if port.startswith(SCHEME):
+            port, options = parse_url(port)
         self.name     = port
         self.port     = port
         self.timeout  = timeout
@@ -22,31 +91,41 @@ class Serial:
         self.xonxoff  = xonxoff
         self.rtscts   = rtscts
         self.is_open  = True
-        self._receivedData = ''
-        self.sum_receivedData = ""
-
-        self.time_last_command = 0
-        
-        self.u = 0
-        self.i = 0
-        self.v_set = 0
-        self.i_set = 0
-        self.u_max = 0
-        self.i_max = 0
-
-    def refresh_board(self):    
-    # this functino is activated when communication with board and refreshes all values
-    # this function simulates the Hardware
-        now_time = time.time()
-        t_delta = now_time - self.time_last_command
-        self.u = gauss(self.v_set,0.1)
-        self.i = gauss(self.i_set,0.1)
-               
-        self.time_last_command = now_time        
-        return
+        self.noise = options.get("noise", noise)
+        self.processing_time = options.get("processing_time", processing_time)
+        self.garble_rate = options.get("garble_rate", garble_rate)
+        self.timeout_rate = options.get("timeout_rate", timeout_rate)
+        self.random = random.Random(options.get("seed", seed))
+        self.virtual = options.get("virtual", virtual)
+        if self.virtual:
+            self._use_virtual_clock()
+
+        self._input = b""
+        # (time the reply is ready to read, reply) of the queries, the board
+        # works on one command after the other
+        self.pending_queries = []
+        self._line_free = 0.
+        self._busy_until = 0.
+        self._output = b""
+        # faults forced on the next replies, see inject()
+        self._faults = []
+
+        self.channel = 1
+        self.channels = {1: ChannelState()}
+
+    @property
+    def byte_time( self ):
+        """Seconds a byte takes on the wire"""
+        parity_bits = 0 if self.parity in (None, 'N') else 1
+        return (1 + self.bytesize + parity_bits + self.stopbits) / self.baudrate
+
+    @property
+    def state( self ):
+        """ChannelState of the addressed channel"""
+        return self.channels.setdefault(self.channel, ChannelState())
 
     ## isOpen()
-    # returns True if the port to the Arduino is open.  False otherwise
+    # returns True if the port to the board is open.  False otherwise
     def isOpen( self ):
         return self.is_open
     ## open()
@@ -58,62 +137,173 @@ class Serial:
     # closes the port
     def close( self ):
         self.is_open = False
+        if self.virtual:
+            self._release_virtual_clock()
+
+    def _use_virtual_clock( self ):
+        global _installed, _previous_source
+        if not _virtual_ports and not isinstance(_clock.source(), _clock.VirtualClock):
+            _previous_source = _clock.source()
+            _installed = _clock.VirtualClock()
+            _clock.use(_installed)
+        _virtual_ports.append(self)
+
+    def _release_virtual_clock( self ):
+        global _installed
+        if self in _virtual_ports:
+            _virtual_ports.remove(self)
+            if not _virtual_ports and _installed is not None:
+                # unless someone replaced it meanwhile
+                if _clock.source() is _installed:
+                    _clock.use(_previous_source)
+                _installed = None
+
+    def inject( self, fault, n=1 ):
+        """Force a fault ("garble" or "timeout") on the next n replies"""
+        if fault not in ("garble", "timeout"):
+            raise ValueError("Unknown fault "+fault)
+        self._faults.extend([fault] * n)
 
     def write( self, string ):
 
-        self._receivedData = string.decode()
-        self.sum_receivedData += self._receivedData
-        if "SO:VO " in self.sum_receivedData:
-            self.v_set = float(self.sum_receivedData.split(' ')[1])
-            self.sum_receivedData = ""
+        # the commands arrive one byte after the other, several commands
+        # may come with one write
+        self._line_free = max(self._line_free, _clock.now())
+        self._input += string
+        while b"\n" in self._input:
+            command, self._input = self._input.split(b"\n", 1)
+            self._line_free += (len(command) + 1) * self.byte_time
+            self.handle_command(command.decode(errors="replace"), self._line_free)
+        return len(string)
+
+    def handle_command( self, command, arrival ):
+
+        start = max(arrival, self._busy_until)
+        start = max(start, self.hold_until(command, start))
+        self._busy_until = start + self.processing_time
+        name, _, argument = command.partition(" ")
+        state = self.state
+        try:
+            if name == "CH" and argument:
+                self.channel = int(argument)
+            elif name == "SO:VO" and argument:
+                state.v_set = float(argument)
+            elif name == "SO:CU" and argument:
+                state.i_set = float(argument)
+            elif name == "SO:VO:MA" and argument:
+                state.v_max = float(argument)
+            elif name == "SO:CU:MA" and argument:
+                state.i_max = float(argument)
+            elif name == "SP" and argument:
+                state.speed = int(argument)
+        except ValueError:
+            pass
+        if name in ("REM", "REM:CV", "LOC", "LOC:CV"):
+            state.remote_cv = int(name.startswith("REM"))
+        if name in ("REM", "REM:CC", "LOC", "LOC:CC"):
+            state.remote_cc = int(name.startswith("REM"))
+
+        # only queries and the channel selection are answered, the answer
+        # belongs to the channel addressed when the query arrived
+        if command.endswith("?") or name == "CH":
+            reply = self.fault(self.answer(command).encode())
+            self._busy_until += len(reply or b"") * self.byte_time
+            if reply is not None:
+                self.pending_queries.append((self._busy_until, reply))
+
+    def hold_until( self, command, start ):
+        # the board takes on the command (it could start at start) not
+        # before this time
+        return 0.
+
+    def answer( self, command ):
+        state = self.state
+        answers = {"CH?": lambda: self.channel,
+                   "SO:VO?": lambda: state.v_set,
+                   "SO:CU?": lambda: state.i_set,
+                   "SO:VO:MA?": lambda: state.v_max,
+                   "SO:CU:MA?": lambda: state.i_max,
+                   "ME:VO?": lambda: self.random.gauss(state.v_set, self.noise),
+                   "ME:CU?": lambda: self.random.gauss(state.i_set, self.noise),
+                   "REM?": lambda: int(state.remote_cv and state.remote_cc),
+                   "REM:CV?": lambda: state.remote_cv,
+                   "REM:CC?": lambda: state.remote_cc,
+                   "SP?": lambda: state.speed}
+        if command.startswith("CH "):
+            answer = ""
+        elif command in answers:
+            answer = answers[command]()
+        else:
+            answer = "????"
+        return str(answer) + TERMINATOR.decode()
+
+    def fault( self, reply ):
+        # the reply with a fault applied, None if it gets lost
+        fault = self._faults.pop(0) if self._faults else None
+        if fault is None and (self.garble_rate or self.timeout_rate):
+            draw = self.random.random()
+            if draw < self.timeout_rate:
+                fault = "timeout"
+            elif draw < self.timeout_rate + self.garble_rate:
+                fault = "garble"
+        if fault == "timeout":
             return None
-            
-        if "SO:CU " in self.sum_receivedData:
-            self.i_set = float(self.sum_receivedData.split(' ')[1])
-            self.sum_receivedData = ""
-            return None     
-            
-        if "SO:VO:MA " in self.sum_receivedData:
-            self.u_max = float(self.sum_receivedData.split(' ')[1])
-            self.sum_receivedData = ""
-            return None   
-            
-        if "SO:CU:MA " in self.sum_receivedData:
-            self.i_max = float(self.sum_receivedData.split(' ')[1])
-            self.sum_receivedData = ""
-            return None                            
-        
+        if fault == "garble":
+            position = self.random.randrange(len(reply) - len(TERMINATOR) + 1)
+            return reply[:position] + GARBLE_BYTE + reply[position+1:-len(TERMINATOR)] + TERMINATOR
+        return reply
+
+    def _collect( self ):
+        # move the replies that are ready to the output buffer
+        now_time = _clock.now()
+        while self.pending_queries and self.pending_queries[0][0] <= now_time:
+            self._output += self.pending_queries.pop(0)[1]
+
+    def _wait( self, deadline ):
+        # wait for the next reply, False if it is not ready by the deadline
+        self._collect()
+        if not self.pending_queries:
+            if deadline is not None:
+                _clock.sleep(deadline - _clock.now())
+            return False
+        ready = self.pending_queries[0][0]
+        if deadline is not None and ready > deadline:
+            _clock.sleep(deadline - _clock.now())
+            return False
+        _clock.sleep(ready - _clock.now())
+        self._collect()
+        return True
+
+    def _deadline( self ):
+        return None if self.timeout is None else _clock.now() + self.timeout
+
+    def reset_input_buffer( self ):
+        self.pending_queries = []
+        self._output = b""
+
+    @property
+    def in_waiting( self ):
+        self._collect()
+        return len(self._output)
 
     ## read()
-    # reads n characters from the fake Arduino. Actually n characters
-    # are read from the string _data and returned to the caller.
+    # reads up to n characters of the replies, waits for the first one until
+    # the timeout
     def read( self, n=1 ):
-        time.sleep(0.02)
-        return self._receivedData.encode()
-        
-        
-    def read_until( self , until):
-        answer = "????"
-        self.refresh_board()
-        if not "\n" in self.sum_receivedData:
-            return self.read()
-        
-        if self.sum_receivedData == "CH?\n":
-            answer = "1"
-        if self.sum_receivedData == "SO:VO?\n":
-            answer = str(self.v_set)
-        if self.sum_receivedData == "SO:CU?\n":
-            answer = str(self.i_set)
-            
-        if self.sum_receivedData == "ME:VO?\n":
-            answer = str(self.u)
-        if self.sum_receivedData == "ME:CU?\n":
-            answer = str(self.i)
-
-        if "CH " in self.sum_receivedData:
-            answer = ""                         
-                                                                                     
-        answer = str(answer) +"\n\r\x04"
-        self.sum_receivedData = ""
-        time.sleep(0.1)
-        return answer.encode()
+        deadline = self._deadline()
+        self._collect()
+        while not self._output:
+            if not self._wait(deadline):
+                return b""
+        data, self._output = self._output[:n], self._output[n:]
+        return data
+
+    def read_until( self , until=TERMINATOR):
+        deadline = self._deadline()
+        self._collect()
+        while until not in self._output:
+            if not self._wait(deadline):
+                data, self._output = self._output, b""
+                return data
+        answer, self._output = self._output.split(until, 1)
+        return answer + until
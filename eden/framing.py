@@ -0,0 +1,74 @@
+"""
+Buffered framing of the PSC replies.
+
+Every reply of the board ends with a terminator. pyserial's read_until()
+reads one byte per call until it sees it, FrameReader instead reads all
+bytes the port holds (in_waiting) into one reusable bytearray and splits
+off complete frames with bytes.find, so there is no per byte Python work.
+A frame cut by a read is completed by the following ones. Frames are
+returned as bytes, float() parses numeric replies from them directly.
+"""
+
+TERMINATOR = b"\n\r\x04"
+
+
+class FrameReader:
+    """Terminated frames read in bulk from a serial port"""
+
+    def __init__(self, port, terminator=TERMINATOR):
+        self.port = port
+        self.terminator = terminator
+        self._buffer = bytearray()
+        # the buffer holds no terminator up to this position
+        self._scanned = 0
+
+    def __len__(self):
+        """Number of buffered bytes"""
+        return len(self._buffer)
+
+    def reset(self):
+        """Drop the buffered bytes"""
+        del self._buffer[:]
+        self._scanned = 0
+
+    def _fill(self, blocking):
+        # everything the port holds, or wait for (at least) one byte
+        n_waiting = self.port.in_waiting
+        if n_waiting:
+            self._buffer += self.port.read(n_waiting)
+            return True
+        if not blocking:
+            return False
+        data = self.port.read(1)
+        self._buffer += data
+        return bool(data)
+
+    def _next_frame(self):
+        start = max(self._scanned - len(self.terminator) + 1, 0)
+        end = self._buffer.find(self.terminator, start)
+        if end < 0:
+            self._scanned = len(self._buffer)
+            return None
+        frame = bytes(self._buffer[:end])
+        del self._buffer[:end + len(self.terminator)]
+        self._scanned = 0
+        return frame
+
+    def read_frame(self):
+        """The next frame, None if the port timed out before it was complete"""
+        while True:
+            frame = self._next_frame()
+            if frame is not None:
+                return frame
+            if not self._fill(blocking=True):
+                return None
+
+    def read_available(self):
+        """All frames completed by the bytes the port holds, without blocking"""
+        self._fill(blocking=False)
+        frames = []
+        frame = self._next_frame()
+        while frame is not None:
+            frames.append(frame)
+            frame = self._next_frame()
+        return frames
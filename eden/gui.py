@@ -15,11 +15,26 @@ from functools import partial
 
 from eden import threads as _thr 
 from eden import Class_PSC as _psc
+from eden import deposition as _dep
+from eden import session_file as _sf
+from eden import loader as _ldr
+from eden import catalog as _cat
+from eden import telemetry as _tel
+from eden import daemon as _dmn
+from eden import target as _tgt
+from eden import program as _prg
 
 # create module logger
 _gui_log = _lg.getLogger("eden.gui")
 _gui_log.setLevel(_lg.DEBUG)
 _lg.debug("Loading eden.gui")
+# the target stops and the programs are reported at INFO
+_lg.getLogger("eden.acquisition").setLevel(_lg.INFO)
+
+# target field units: (eden.target kind, factor to the units of eden.analysis)
+TARGET_UNITS = OrderedDict([("Charge (C)", ("charge", 1.)),
+                            ("Mass (mg)", ("mass", 1E-3)),
+                            ("Thickness (nm)", ("thickness", 1E-7))])
 
 
 class MainWindow(_qw.QMainWindow):
@@ -40,6 +55,13 @@ class MainWindow(_qw.QMainWindow):
         self.sample_defined = False
         self.measurement_running = False
         self.data = _np.array((0))
+        # data of the other channels polled on the PSC connection, by channel
+        self.channel_data = {}
+        # exact charge of the data (C) if known, by channel for the others
+        self.total_charge = None
+        self.channel_charges = {}
+        self.reader_was_recording = False
+        self.deposition = _dep.DepositionTracker()
         #self.data = _np.array(((10,11,12), (20,21,22)))
         self.unsaved_changes = False
 
@@ -61,6 +83,13 @@ class MainWindow(_qw.QMainWindow):
     def updateUI(self):
 
         self.update_overview()
+        self.update_telemetry()
+
+    def update_telemetry(self):
+        if self.psc_connected:
+            self.telemetry_label.setText(self.psc.telemetry.status_text())
+        else:
+            self.telemetry_label.setText("")
        
 
     def _init_geom(self):
@@ -90,6 +119,8 @@ class MainWindow(_qw.QMainWindow):
 		                 _qc.Qt.CTRL + _qc.Qt.Key_S)
         self.load_measurement_action = self.file_menu.addAction("&Load", self.load_data,
 		                 _qc.Qt.CTRL + _qc.Qt.Key_O)
+        self.find_run_action = self.file_menu.addAction("&Find run", self.find_run,
+		                 _qc.Qt.CTRL + _qc.Qt.Key_F)
         self.file_menu.addAction("&Quit", self.file_quit,
 		                 _qc.Qt.CTRL + _qc.Qt.Key_Q)
 
@@ -113,6 +144,9 @@ class MainWindow(_qw.QMainWindow):
         MainWindow.log.debug("Called MainWindow._init_status_bar")
 
         self.statusBar().showMessage('Program started')
+        # serial link telemetry of the connected PSC
+        self.telemetry_label = _qw.QLabel("")
+        self.statusBar().addPermanentWidget(self.telemetry_label)
 
     def _init_subwindows(self):
         """Create the tabs"""
@@ -196,14 +230,25 @@ class MainWindow(_qw.QMainWindow):
         self.set_voltage_line = _qw.QLineEdit(self.overviewTab)
         set_current_label = _qw.QLabel("Set Current (A)")
         self.set_current_line = _qw.QLineEdit(self.overviewTab)
+        set_channel_label = _qw.QLabel("Channel")
+        self.set_channel_combo = _qw.QComboBox(self.overviewTab)
         self.set_submit_button = _qw.QPushButton("&Set values")
         self.set_submit_button.clicked.connect(self.set_values_to_psc)
+        # timed setpoint programs, see eden.program
+        self.start_program_button = _qw.QPushButton("Run &program...")
+        self.start_program_button.clicked.connect(self.start_program)
+        self.stop_program_button = _qw.QPushButton("Stop p&rogram")
+        self.stop_program_button.clicked.connect(self.stop_program)
         # add them to the layout
         grid_layout_set_fields.addWidget(set_voltage_label,1,1)
         grid_layout_set_fields.addWidget(self.set_voltage_line,1,2)
         grid_layout_set_fields.addWidget(set_current_label,2,1)
         grid_layout_set_fields.addWidget(self.set_current_line,2,2)
-        grid_layout_set_fields.addWidget(self.set_submit_button,3,1,1,2)
+        grid_layout_set_fields.addWidget(set_channel_label,3,1)
+        grid_layout_set_fields.addWidget(self.set_channel_combo,3,2)
+        grid_layout_set_fields.addWidget(self.set_submit_button,4,1,1,2)
+        grid_layout_set_fields.addWidget(self.start_program_button,5,1)
+        grid_layout_set_fields.addWidget(self.stop_program_button,5,2)
         set_fields_group_box.setLayout(grid_layout_set_fields)
         
         grid_layout = _qw.QGridLayout()
@@ -226,12 +271,32 @@ class MainWindow(_qw.QMainWindow):
             
             # if we have a reader thread that is recording, take its data
             if self.psc.is_connected:
-                if self.psc.reader_thread.is_recording:
+                # the reader stores the last samples after the stop, they
+                # are taken once the recording is closed
+                recording_open = self.psc.reader_thread.recording_open
+                if recording_open or self.reader_was_recording:
+                    self.channel_data = {channel: buffer.view() for channel, buffer
+                                         in self.psc.reader_thread.channel_data.items()
+                                         if channel != self.psc.channel and len(buffer)}
+                    self.total_charge = self.psc.reader_thread.total_charge
+                    self.channel_charges = {channel: recorder.charge for channel, recorder
+                                            in self.psc.reader_thread.recorders.items()
+                                            if channel in self.channel_data}
                     if len(self.psc.reader_thread.reader_data):
-                        self.data = self.psc.reader_thread.reader_data
-                        if self.plotter_thread.mass and self.plotter_thread.thickness:
-                            self.deposited_mass_line.setText(str(round(self.plotter_thread.mass*1E3, 3)))
-                            self.deposited_thickness_line.setText(str(round(self.plotter_thread.thickness*1E-2*1E9, 3)))
+                        self.data = self.psc.reader_thread.reader_data.view()
+                        self.deposition.update(self.data, self.sample_area, self.total_charge)
+                        if self.deposition.mass and self.deposition.thickness:
+                            self.deposited_mass_line.setText(str(round(self.deposition.mass*1E3, 3)))
+                            self.deposited_thickness_line.setText(str(round(self.deposition.thickness*1E-2*1E9, 3)))
+                self.reader_was_recording = recording_open
+                # the reader zeroed the output at the target and ended the recording
+                target = self.psc.reader_thread.target
+                if (self.measurement_running and target is not None and target.reached
+                        and not self.psc.reader_thread.is_recording):
+                    self.stop_measurement()
+                    if target.latency is not None:
+                        self.statusBar().showMessage("target reached, output zeroed after %.0f ms"
+                                                     % (target.latency * 1E3))
                         
                         
         return
@@ -272,6 +337,26 @@ class MainWindow(_qw.QMainWindow):
         self.sample_surface_line_edit = _qw.QLineEdit(self.settingsTab)
         self.submit_sample_button = _qw.QPushButton("&Submit")
         self.submit_sample_button.clicked.connect(self.submit_sample_info)
+
+        # Settings for the recording, empty fields keep every sample
+        recording_group_box = _qw.QGroupBox("Recording settings:")
+        grid_recording = _qw.QGridLayout()
+        poll_interval_label = _qw.QLabel("Poll interval (s):")
+        self.poll_interval_line_edit = _qw.QLineEdit(self.settingsTab)
+        max_interval_label = _qw.QLabel("Max. interval (s):")
+        self.max_interval_line_edit = _qw.QLineEdit(self.settingsTab)
+        deadband_voltage_label = _qw.QLabel("Deadband U (V):")
+        self.deadband_voltage_line_edit = _qw.QLineEdit(self.settingsTab)
+        deadband_current_label = _qw.QLabel("Deadband I (A):")
+        self.deadband_current_line_edit = _qw.QLineEdit(self.settingsTab)
+        self.align_voltage_check_box = _qw.QCheckBox("Interpolate the voltage to the time of the current",
+                                                     self.settingsTab)
+        # the output is zeroed once the target is reached, empty runs until stopped
+        target_label = _qw.QLabel("Stop at:")
+        self.target_kind_combo_box = _qw.QComboBox(self.settingsTab)
+        for text in TARGET_UNITS:
+            self.target_kind_combo_box.addItem(text)
+        self.target_line_edit = _qw.QLineEdit(self.settingsTab)
         
 
         # layout definition for all widgets defined above
@@ -296,9 +381,24 @@ class MainWindow(_qw.QMainWindow):
         grid_sample.addWidget(self.submit_sample_button, 3,1,1,4)
         
         sample_group_box.setLayout(grid_sample)
+
+        grid_recording.addWidget(poll_interval_label, 1,1)
+        grid_recording.addWidget(self.poll_interval_line_edit, 1,2)
+        grid_recording.addWidget(max_interval_label, 1,3)
+        grid_recording.addWidget(self.max_interval_line_edit, 1,4)
+        grid_recording.addWidget(deadband_voltage_label, 2,1)
+        grid_recording.addWidget(self.deadband_voltage_line_edit, 2,2)
+        grid_recording.addWidget(deadband_current_label, 2,3)
+        grid_recording.addWidget(self.deadband_current_line_edit, 2,4)
+        grid_recording.addWidget(self.align_voltage_check_box, 3,1,1,4)
+        grid_recording.addWidget(target_label, 4,1)
+        grid_recording.addWidget(self.target_kind_combo_box, 4,2)
+        grid_recording.addWidget(self.target_line_edit, 4,3,1,2)
+        recording_group_box.setLayout(grid_recording)
         
         vbox_layout.addWidget(ps_group_box)
         vbox_layout.addWidget(sample_group_box)
+        vbox_layout.addWidget(recording_group_box)
         self.settingsTab.setLayout(vbox_layout)
         # set defaults
         self.set_eden_defaults()
@@ -313,18 +413,42 @@ class MainWindow(_qw.QMainWindow):
 
     def connect_psc(self):
         self.statusBar().showMessage('connecting PSC')
+        if self.psc_com_line_edit.text().startswith(_dmn.SCHEME):
+            self.attach_daemon(self.psc_com_line_edit.text())
+            return
         try:
-            self.psc = _psc.PSC(self.psc_com_line_edit.text(), int(self.psc_channel_line_edit.text()))
+            # several channels are polled on one connection, e.g. "1, 2, 3"
+            channels = [int(channel) for channel in self.psc_channel_line_edit.text().split(",")]
+            self.psc = _psc.PSC(self.psc_com_line_edit.text(), channels[0], channels[1:])
             self.psc.establish_connection()
             self.psc_connected = self.psc.is_connected
             self.psc.activate_chan()
-            self.psc.set_max_vol(int(self.ps_umax_line_edit.text()))
-            self.psc.set_max_cu(int(self.ps_imax_line_edit.text()))           
+            for channel in self.psc.channels:
+                self.psc.select_channel(channel)
+                self.psc.set_max_vol(int(self.ps_umax_line_edit.text()))
+                self.psc.set_max_cu(int(self.ps_imax_line_edit.text()))           
         
         except (ValueError, TypeError):
             self.err_msg_sample_values = _qw.QMessageBox.warning(self, "Values",
-            "The board channel needs to be an integer!")
+            "The board channels need to be integers!")
+            return
+        self.psc_connected_to(self.psc)
+
+    def attach_daemon(self, port):
+        # the daemon owns the board, the window only views and controls it
+        try:
+            psc = _dmn.RemotePSC(port)
+        except (OSError, ValueError, _dmn.DaemonError) as error:
+            self.err_msg_sample_values = _qw.QMessageBox.warning(self, "Daemon",
+            "Cannot attach to the daemon: "+str(error))
             return
+        self.psc = psc
+        self.psc_connected = True
+        self.psc_connected_to(psc)
+
+    def psc_connected_to(self, psc):
+        self.set_channel_combo.clear()
+        self.set_channel_combo.addItems([str(channel) for channel in psc.channels])
             
         self.psc_com_line_edit.setDisabled(True)
         self.psc_channel_line_edit.setDisabled(True)
@@ -339,28 +463,34 @@ class MainWindow(_qw.QMainWindow):
     def disconnect_psc(self):
         self.statusBar().showMessage('disconnecting PSC')
         
-        if self.psc.reader_thread.is_recording:
+        # a daemon keeps recording without the GUI
+        remote = isinstance(self.psc, _dmn.RemotePSC)
+        if self.psc.reader_thread.is_recording and not remote:
             self.err_msg_sample_values = _qw.QMessageBox.warning(self, "ERROR",
             "Running measurement. Board can not be disconnected!")
             return
-      
-        # stop the reader thread
-        self.psc.reader_thread.stop_thread = True
-        while self.psc.board_busy:
-            time.sleep(0.1)
-        
-        self.psc.close_connection()
+        if self.measurement_running:
+            self.enable_measurement_controls()
+            self.measurement_running = False
+
+        # the reader thread owns the port and closes it once it has stopped,
+        # connecting again is possible after that
+        self.psc.reader_thread.finished.connect(self.psc_disconnected)
+        self.psc.reader_thread.request_stop(close_connection=True)
         self.psc_connected = False    
         self.psc = None
+        self.set_channel_combo.clear()
+        self.disconnect_psc_button.setEnabled(False)         
         
+        return
+
+    def psc_disconnected(self):
         self.psc_com_line_edit.setDisabled(False)
         self.psc_channel_line_edit.setDisabled(False)
         self.ps_umax_line_edit.setDisabled(False)
         self.ps_imax_line_edit.setDisabled(False)
         self.connect_psc_button.setEnabled(True)
-        self.disconnect_psc_button.setEnabled(False)         
-        
-        return
+        self.statusBar().showMessage('PSC disconnected')
 
     def submit_sample_info(self):
         # store the inputs from the text fields into the variable names
@@ -374,8 +504,38 @@ class MainWindow(_qw.QMainWindow):
             self.err_msg_sample_values = _qw.QMessageBox.warning(self, "Values",
             "Invalid input for the Sample surface!")
             
+    def recording_settings(self):
+        # poll interval and deadband settings, None for empty fields
+        values = []
+        for line_edit in (self.poll_interval_line_edit, self.deadband_voltage_line_edit,
+                          self.deadband_current_line_edit, self.max_interval_line_edit):
+            text = line_edit.text().strip()
+            values.append(float(text) if text else None)
+        if any(value is not None and value <= 0 for value in values):
+            raise ValueError("recording settings must be positive")
+        sample_interval, deadband = values[0], tuple(values[1:])
+        if deadband == (None, None, None):
+            deadband = None
+        return sample_interval, deadband
+
+    def target_setting(self):
+        # TargetStop of the target field, None if empty
+        text = self.target_line_edit.text().strip()
+        if not text:
+            return None
+        kind, scale = TARGET_UNITS[self.target_kind_combo_box.currentText()]
+        surface = self.sample_area if self.sample_defined else None
+        return _tgt.TargetStop(_tgt.target_charge(kind, float(text) * scale, surface))
+
     def start_measurement(self):
         self.statusBar().showMessage('starting measurement')
+        try:
+            sample_interval, deadband = self.recording_settings()
+            target = self.target_setting()
+        except ValueError:
+            self.err_msg_sample_values = _qw.QMessageBox.warning(self, "Values",
+            "Invalid input for the recording settings!")
+            return
         # check that the PSC is connected and the sample is defined
         if self.psc_connected and self.sample_defined:
             # ask for clearing  previous data
@@ -390,9 +550,21 @@ class MainWindow(_qw.QMainWindow):
             # disable the data actions: new, save and load 
             self.new_measurement_action.setDisabled(True)
             self.load_measurement_action.setDisabled(True)
+            self.find_run_action.setDisabled(True)
             self.save_measurement_action.setDisabled(True)
             # start the measurement!
             self.measurement_running = True
+            self.psc.reader_thread.sample_info = _sf.metadata(self.sample_area, self.sample_name,
+                                                              self.coating_step)
+            self.psc.reader_thread.sample_interval = sample_interval
+            self.psc.reader_thread.deadband = deadband
+            self.psc.reader_thread.align_voltage = self.align_voltage_check_box.isChecked()
+            self.psc.reader_thread.recorders = {}
+            self.psc.reader_thread.target = target
+            # the exported telemetry and setpoints cover the measurement
+            self.psc.telemetry.reset()
+            if not isinstance(self.psc, _dmn.RemotePSC):
+                self.psc.reader_thread.setpoint_log.reset()
             self.psc.reader_thread.is_recording = True
             # we then also have new data, i.e. unsaved changes!
             self.unsaved_changes = True
@@ -403,6 +575,13 @@ class MainWindow(_qw.QMainWindow):
         
     def stop_measurement(self):
         self.statusBar().showMessage('stopping measurement')
+        self.enable_measurement_controls()
+        # stop the measurement!
+        self.psc.reader_thread.is_recording = False
+        self.measurement_running = False
+        return
+
+    def enable_measurement_controls(self):
         # enable all the sample input fields
         self.sample_name_line_edit.setDisabled(False)
         self.coating_step_line_edit.setDisabled(False)
@@ -413,17 +592,18 @@ class MainWindow(_qw.QMainWindow):
         # enable the file actions again
         self.new_measurement_action.setDisabled(False)
         self.load_measurement_action.setDisabled(False)
-        self.save_measurement_action.setDisabled(False)        
-        # stop the measurement!
-        self.psc.reader_thread.is_recording = False
-        self.measurement_running = False
-        return
+        self.find_run_action.setDisabled(False)
+        self.save_measurement_action.setDisabled(False)
         
     def start_reader_thread(self):
         self.statusBar().showMessage('starting module reader thread')
         
         if not self.psc.reader_thread:
-            module_thread = _thr.PscReader(self.psc)
+            if isinstance(self.psc, _dmn.RemotePSC):
+                module_thread = _thr.RemoteReader(self.psc)
+            else:
+                module_thread = _thr.PscReader(self.psc)
+            module_thread.command_failed.connect(self.report_command_failure)
             self.psc.set_readerthread(module_thread)
             module_thread.start()
             MainWindow.log.debug("reader thread started")
@@ -431,6 +611,9 @@ class MainWindow(_qw.QMainWindow):
         
         return
 
+    def report_command_failure(self, message):
+        self.statusBar().showMessage("PSC command failed: "+message)
+
     def stop_reader_thread(self, module):
         if not module.is_connected:
             return False
@@ -460,16 +643,39 @@ class MainWindow(_qw.QMainWindow):
             "Connect the PSC first!")
             return
         
-        if self.psc.board_busy:
-            # halt reader thread
-            self.psc.reader_thread.halt_thread = True
-            while self.psc.board_busy:
-                time.sleep(0.1)
-            self.psc.set_set_vol(voltage)
-            self.psc.set_set_cu(current)
-            self.psc.reader_thread.halt_thread = False
+        # queued on the reader thread, ahead of the next measurement
+        channel = int(self.set_channel_combo.currentText() or self.psc.channel)
+        self.psc.reader_thread.set_setpoints(voltage, current, channel)
+        self.statusBar().showMessage("setpoints queued for channel "+str(channel)+": "
+                                     +str(voltage)+" V, "+str(current)+" A")
         return
 
+    def start_program(self):
+
+        if not self.psc_connected:
+            self.err_msg_no_data = _qw.QMessageBox.warning(self, "Error",
+            "Connect the PSC first!")
+            return
+        filename, _ = _qw.QFileDialog.getOpenFileName(self, "Setpoint program", "",
+                                                      "Programs (*.json)")
+        if not filename:
+            return
+        channel = int(self.set_channel_combo.currentText() or self.psc.channel)
+        try:
+            self.psc.reader_thread.start_program(_prg.load(filename), channel)
+        except (OSError, ValueError, TypeError, KeyError) as error:
+            self.err_msg_no_data = _qw.QMessageBox.warning(self, "Error",
+            "Invalid program: "+str(error))
+            return
+        self.statusBar().showMessage("program "+os.path.basename(filename)
+                                     +" queued for channel "+str(channel))
+
+    def stop_program(self):
+
+        if self.psc_connected:
+            self.psc.reader_thread.stop_program()
+            self.statusBar().showMessage("program stopped")
+
 
     def clear_data(self):
         if self.data.any() or self.unsaved_changes:
@@ -481,8 +687,12 @@ class MainWindow(_qw.QMainWindow):
                 self.save_data()
             elif reply == _qw.QMessageBox.No:
                 self.data = _np.array((0))
+                self.channel_data = {}
+                self.total_charge = None
+                self.channel_charges = {}
                 if self.psc.is_connected:
-                    self.psc.reader_thread.reader_data = []
+                    for buffer in self.psc.reader_thread.channel_data.values():
+                        buffer.clear()
                 self.unsaved_changes = False
             else:
                 return
@@ -496,16 +706,11 @@ class MainWindow(_qw.QMainWindow):
             return
         # Save the acquired data to a file
         default_filename = time.strftime("%Y%m%d_%H%M%S", time.gmtime())
-        file_header = "UNIX time, Current (A), PS Voltage (V), REF Voltage (V)\n"
-        if self.sample_defined:
-            file_header += "SAMPLE_SURFACE = "+str(self.sample_area)+"\n"
         if self.sample_name:
             default_filename += "_"+self.sample_name
-            file_header += "SAMPLE_NAME = "+self.sample_name+"\n"
         if self.coating_step:
             default_filename += "_"+self.coating_step
-            file_header += "COATING_STEP = "+self.coating_step
-        default_filename += ".dat"
+        default_filename += _sf.EXTENSION
         dialog = _qw.QFileDialog()
         dialog.setFileMode(_qw.QFileDialog.AnyFile)
         dialog.setDirectory(os.path.join("eden","data"))
@@ -514,13 +719,36 @@ class MainWindow(_qw.QMainWindow):
         filename = ""
         if dialog.exec_():
             filename = dialog.selectedFiles()[0]
-            _np.savetxt(filename, self.data, header=file_header, delimiter='\t')
+            sample_surface = self.sample_area if self.sample_defined else None
+            # the legacy text layout is still written on request
+            save = _sf.save_dat if filename.endswith(".dat") else _sf.save
+            save(filename, self.data, sample_surface, self.sample_name, self.coating_step,
+                 self.total_charge)
+            # every other channel goes to its own file next to it
+            root, extension = os.path.splitext(filename)
+            for channel, data in self.channel_data.items():
+                save(root+"_ch"+str(channel)+extension, data, sample_surface,
+                     self.sample_name, self.coating_step, self.channel_charges.get(channel))
+            # and the serial link telemetry
+            if self.psc_connected:
+                self.psc.telemetry.export(root+_tel.EXTENSION, port=self.psc.port,
+                                          channels=self.psc.channels, session=filename)
+                # the daemon saves the setpoints of its recordings itself
+                if not isinstance(self.psc, _dmn.RemotePSC):
+                    program = self.psc.reader_thread.program
+                    self.psc.reader_thread.setpoint_log.export(
+                        root+_prg.EXTENSION, session=filename,
+                        program=None if program is None else program.summary(),
+                        segments=None if program is None else program.segments)
+                    target = self.psc.reader_thread.target
+                    if target is not None:
+                        target.export(root+_tgt.EXTENSION, session=filename)
 
         self.unsaved_changes = False
         return
         
-    def load_data(self):
-        # check if there is data already
+    def confirm_discard(self):
+        # check if there is data already, returns False if the user cancelled
         if self.data.any() and self.unsaved_changes:
             reply = _qw.QMessageBox.question(self, 'Confirm',
 	            'Do you want to save the data first?', _qw.QMessageBox.Yes |
@@ -530,38 +758,62 @@ class MainWindow(_qw.QMainWindow):
                 self.save_data()
             elif reply == _qw.QMessageBox.No:
                 self.data = None
+                self.channel_data = {}
+                self.total_charge = None
+                self.channel_charges = {}
                 self.unsaved_changes = False
             else:
-                return
+                return False
+        return True
+
+    def load_data(self):
+        if not self.confirm_discard():
+            return
         dialog = _qw.QFileDialog()
         dialog.setFileMode(_qw.QFileDialog.ExistingFile)
         dialog.setDirectory(os.path.join("eden","data"))
-        filename = ""
         if dialog.exec_():
-            filename = dialog.selectedFiles()[0]
-            self.data = _np.loadtxt(filename, delimiter='\t', skiprows=3)
-            # try to get the sample name, coating step and sample surface from file header
-            with open(filename, "r") as f_in:
-                this_line = f_in.readline()
-                while this_line:
-                    if not this_line[0] is "#":
-                        break
-                    else:
-                        res1 = this_line.split("# SAMPLE_SURFACE = ")
-                        res2 = this_line.split("# SAMPLE_NAME = ")
-                        res3 = this_line.split("# COATING_STEP = ")
-                        if len(res1) == 2:
-                            self.sample_area = float(res1[1].strip())
-                            self.sample_surface_line_edit.setText(str(self.sample_area))
-                        if len(res2) == 2:
-                            self.sample_name = res2[1].strip()
-                            self.sample_name_line_edit.setText(self.sample_name)
-                        if len(res3) == 2:
-                            self.coating_step = res3[1].strip()
-                            self.coating_step_line_edit.setText(self.coating_step)
-                    this_line = f_in.readline()
+            self.load_file(dialog.selectedFiles()[0])
+        return
+
+    def find_run(self):
+        # pick a run from the catalog of the data directory
+        directory = os.path.join("eden","data")
+        if not os.path.isdir(directory):
+            self.err_msg_no_data = _qw.QMessageBox.warning(self, "Error",
+            "The data directory "+directory+" does not exist!")
+            return
+        if not self.confirm_discard():
+            return
+        self.statusBar().showMessage("updating the run catalog")
+        dialog = RunBrowser(self, directory)
+        if dialog.exec_() and dialog.selected_path:
+            self.load_file(dialog.selected_path)
+        return
+
+    def load_file(self, filename):
+        # session files are memory mapped, any other layout gets parsed
+        self.data, meta = _ldr.load(filename)
+        self.channel_data = {}
+        self.total_charge = meta["total_charge"]
+        self.channel_charges = {}
+        self.set_sample_info(meta)
+        self.statusBar().showMessage("loaded "+filename)
         return
         
+    def set_sample_info(self, meta):
+        # fill in the sample name, coating step and sample surface of a loaded file
+        if meta["sample_surface"] is not None:
+            self.sample_area = meta["sample_surface"]
+            self.sample_surface_line_edit.setText(str(self.sample_area))
+        if meta["sample_name"]:
+            self.sample_name = meta["sample_name"]
+            self.sample_name_line_edit.setText(self.sample_name)
+        if meta["coating_step"]:
+            self.coating_step = meta["coating_step"]
+            self.coating_step_line_edit.setText(self.coating_step)
+        return
+
     def file_quit(self):
         """Closes the application"""
         MainWindow.log.debug("Called MainWindow.file_quit")
@@ -582,5 +834,73 @@ class MainWindow(_qw.QMainWindow):
                     self.save_data()
             self.close()
         else:
-            return 
+            return
+
+
+class RunBrowser(_qw.QDialog):
+    """Lists the runs of a data directory from its catalog"""
+
+    log = _lg.getLogger("eden.gui.RunBrowser")
+    columns = (("Start", "start_time"), ("Sample", "sample_name"), ("Step", "coating_step"),
+               ("Samples", "n_rows"), ("Mass (mg)", "mass"), ("File", "path"))
+
+    def __init__(self, parent, directory):
 
+        super().__init__(parent)
+        RunBrowser.log.debug("Created RunBrowser")
+        self.setWindowTitle("Find run")
+        self.resize(800, 500)
+        self.selected_path = None
+        self.paths = []
+
+        # only new and changed files get indexed
+        self.catalog = _cat.Catalog(directory)
+        self.catalog.update()
+
+        self.filter_line_edit = _qw.QLineEdit(self)
+        self.filter_line_edit.setPlaceholderText("Sample name")
+        self.filter_line_edit.textChanged.connect(self.refresh)
+        self.table = _qw.QTableWidget(0, len(RunBrowser.columns), self)
+        self.table.setHorizontalHeaderLabels([label for label, _ in RunBrowser.columns])
+        self.table.setSelectionBehavior(_qw.QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(_qw.QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(_qw.QAbstractItemView.NoEditTriggers)
+        self.table.doubleClicked.connect(self.accept_selection)
+        open_button = _qw.QPushButton("&Open")
+        open_button.clicked.connect(self.accept_selection)
+
+        vbox_layout = _qw.QVBoxLayout()
+        vbox_layout.addWidget(self.filter_line_edit)
+        vbox_layout.addWidget(self.table)
+        vbox_layout.addWidget(open_button)
+        self.setLayout(vbox_layout)
+        self.refresh()
+
+    def refresh(self):
+
+        entries = self.catalog.query(sample_name=self.filter_line_edit.text().strip())
+        self.paths = [entry["path"] for entry in entries]
+        self.table.setRowCount(len(entries))
+        for row, entry in enumerate(entries):
+            for column, (_, key) in enumerate(RunBrowser.columns):
+                value = entry[key]
+                if key == "start_time":
+                    value = _cat.format_time(value)
+                elif key == "mass":
+                    value = "-" if value is None else "%.4f" % (value*1E3)
+                elif key == "path":
+                    value = os.path.basename(value)
+                self.table.setItem(row, column, _qw.QTableWidgetItem(str(value)))
+        self.table.resizeColumnsToContents()
+
+    def accept_selection(self):
+
+        row = self.table.currentRow()
+        if row >= 0:
+            self.selected_path = self.paths[row]
+            self.accept()
+
+    def done(self, result):
+
+        self.catalog.close()
+        super().done(result)
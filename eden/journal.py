@@ -0,0 +1,161 @@
+"""
+Crash-safe append-only journal of the recorded samples.
+
+While a measurement is recorded the reader thread appends every sample to a
+journal file (tmp_<epoch>.edj). The file starts with a session file header
+(see eden.session_file) holding the sample metadata and continues with the
+rows as little-endian float64 (time, current, voltage). Rows are collected
+in memory and written, flushed and fsync'ed in batches every
+flush_interval seconds, so a crash loses at most that much data. A row
+that was only partially written is dropped on recovery. The total charge
+in the header is updated with every batch.
+
+Usage:
+    python -m eden.journal recover tmp_1559832417.edj [out.eden]
+    python -m eden.journal recover tmp_20190606_150509_Tubes_batch2_2.dat [out.eden]
+
+The second form reads the old text spill files (time, voltage, current).
+"""
+
+import argparse
+import os
+import struct
+import time
+import numpy as _np
+
+from eden import session_file as _sf
+
+MAGIC = b"EDEN-JNL"
+EXTENSION = ".edj"
+# position of the total charge in the header
+_CHARGE = struct.Struct("<d")
+_CHARGE_OFFSET = _sf.HEADER_DTYPE.fields["total_charge"][1]
+
+
+class SampleJournal:
+    """Buffered binary append log with batched flush and fsync"""
+
+    def __init__(self, filename, n_columns=3, flush_interval=1.0, sample_surface=None,
+                 sample_name="", coating_step="", total_charge=None):
+        self.filename = filename
+        self.n_columns = n_columns
+        self.flush_interval = flush_interval
+        self.total_charge = total_charge
+        self._written_charge = total_charge
+        self._row = struct.Struct("<"+str(n_columns)+"d")
+        self._pending = bytearray()
+        self._file = open(filename, "wb")
+        self._file.write(_sf.make_header(n_columns, 0, sample_surface, sample_name,
+                                         coating_step, total_charge, magic=MAGIC))
+        self._sync()
+        self._last_flush = time.monotonic()
+
+    def append(self, row):
+        """Add a row, written to disk with the next batch"""
+        self._pending += self._row.pack(*row)
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def set_total_charge(self, total_charge):
+        """Update the total charge, written to disk with the next batch"""
+        self.total_charge = total_charge
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def flush(self):
+        """Write, flush and fsync the pending rows and the total charge"""
+        charge_changed = self.total_charge is not None and self.total_charge != self._written_charge
+        if self._pending or charge_changed:
+            self._file.write(self._pending)
+            del self._pending[:]
+            if charge_changed:
+                self._file.seek(_CHARGE_OFFSET)
+                self._file.write(_CHARGE.pack(self.total_charge))
+                self._file.seek(0, os.SEEK_END)
+                self._written_charge = self.total_charge
+            self._sync()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+
+def is_journal(filename):
+    """True if filename starts with the journal magic"""
+    with open(filename, "rb") as f_in:
+        return f_in.read(len(MAGIC)) == MAGIC
+
+
+def read(filename):
+    """Rows and metadata of a journal, a trailing partial row is dropped"""
+    header = _sf.read_header(filename, magic=MAGIC)
+    n_columns = int(header["n_columns"])
+    rows = _np.fromfile(filename, dtype=_sf.DATA_DTYPE, offset=_sf.HEADER_DTYPE.itemsize)
+    n_rows = rows.shape[0] // n_columns
+    data = rows[:n_rows*n_columns].reshape((n_rows, n_columns))
+    return data, _sf.header_metadata(header)
+
+
+def read_text_spill(filename):
+    """Rows of an old tmp_*.dat text spill, reordered to (time, current, voltage)"""
+    with open(filename, "r") as f_in:
+        lines = f_in.read().splitlines()
+    # the last line may have been cut by the crash
+    rows = [this_line.split() for this_line in lines]
+    rows = [row for row in rows if len(row) == 3]
+    try:
+        _np.asarray(rows[-1:], dtype=float)
+    except ValueError:
+        rows = rows[:-1]
+    data = _np.asarray(rows, dtype=float).reshape((-1, 3))
+    return data[:, (0, 2, 1)], _sf.metadata()
+
+
+def recover(src, dst, sample_surface=None, sample_name=None, coating_step=None):
+    """Rebuild a session file (or a .dat file) from a journal or text spill.
+
+    Metadata given here takes precedence over the one stored in the journal.
+    Returns the number of recovered rows.
+    """
+    if is_journal(src):
+        data, meta = read(src)
+    else:
+        data, meta = read_text_spill(src)
+    if sample_surface is not None:
+        meta["sample_surface"] = sample_surface
+    if sample_name is not None:
+        meta["sample_name"] = sample_name
+    if coating_step is not None:
+        meta["coating_step"] = coating_step
+    if dst.endswith(".dat"):
+        _sf.save_dat(dst, data, **meta)
+    else:
+        _sf.save(dst, data, **meta)
+    return data.shape[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recover an EDen session from a crash journal")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    recover_parser = subparsers.add_parser("recover", help="rebuild a session file")
+    recover_parser.add_argument("src", help="journal (.edj) or old tmp_*.dat text spill")
+    recover_parser.add_argument("dst", nargs="?", help="output session file (.eden) or .dat file")
+    recover_parser.add_argument("--surface", type=float, default=None, help="sample surface (cm^2)")
+    recover_parser.add_argument("--name", default=None, help="sample name")
+    recover_parser.add_argument("--step", default=None, help="coating step")
+    args = parser.parse_args()
+
+    dst = args.dst or os.path.splitext(args.src)[0]+_sf.EXTENSION
+    n_rows = recover(args.src, dst, args.surface, args.name, args.step)
+    print("recovered "+str(n_rows)+" samples into "+dst)
+
+
+if __name__ == "__main__":
+    main()
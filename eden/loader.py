@@ -0,0 +1,172 @@
+"""
+Loader for every data layout found in the data archive.
+
+Supported layouts (detected from the first bytes of the file):
+    session   binary session files written by the GUI (.eden)
+    journal   crash journals written while recording (.edj)
+    gui       text files written by the GUI, '#' metadata lines followed by
+              tab separated time, current and voltage
+    labview   the 2017 files: an ISO time stamp line, a 'Time val0' and a
+              's A' header line, then the time since start and the current
+    spill     header-less text with time, voltage and current, the old
+              tmp_*.dat spill files and the *_backup.txt files
+    empty     files without any data
+
+load() returns (data, metadata) for all of them. data always holds the
+columns UNIX time, current (A) and voltage (V); the voltage of the labview
+files is NaN. The text layouts are read with a single read of the file and
+the numeric body is parsed in one go by numpy's C parser.
+"""
+
+import datetime as _datetime
+import os
+import numpy as _np
+
+from eden import journal as _jnl
+from eden import session_file as _sf
+
+FORMATS = ("session", "journal", "gui", "labview", "spill", "empty")
+# files next to the data which are no data files (telemetry exports)
+IGNORED_EXTENSIONS = (".json",)
+
+
+def detect_format(head):
+    """Layout of a file from its first bytes"""
+    if head.startswith(_sf.MAGIC):
+        return "session"
+    if head.startswith(_jnl.MAGIC):
+        return "journal"
+    stripped = head.lstrip()
+    if not stripped:
+        return "empty"
+    if stripped.startswith(b"#"):
+        return "gui"
+    # a time stamp like 2017-05-11T16:08:20.099+02:00
+    if stripped[4:5] == b"-" and b"T" in stripped.split(b"\n", 1)[0]:
+        return "labview"
+    return "spill"
+
+
+def _split_lines(raw, n_lines, offset=0):
+    """The next n_lines lines of raw starting at offset and the new offset"""
+    lines = []
+    for _ in range(n_lines):
+        end = raw.find(b"\n", offset)
+        if end < 0:
+            end = len(raw)
+        lines.append(raw[offset:end].strip())
+        offset = end + 1
+    return lines, offset
+
+
+def parse_body(body, n_columns=None):
+    """Parse whitespace separated numbers into rows of n_columns.
+
+    n_columns defaults to the number of values in the first line. A last
+    row that was only partially written is dropped.
+    """
+    body = body.strip()
+    if not body:
+        return _np.empty((0, n_columns or 3))
+    if n_columns is None:
+        n_columns = len(body.split(b"\n", 1)[0].split())
+    try:
+        values = _np.fromstring(body, sep=" ")
+    except ValueError:
+        # something unparseable in between, fall back to a line by line parse
+        rows = [line.split() for line in body.splitlines()]
+        rows = [row for row in rows if len(row) == n_columns]
+        values = []
+        for row in rows:
+            try:
+                values.extend([float(value) for value in row])
+            except ValueError:
+                continue
+        values = _np.asarray(values, dtype=float)
+    n_rows = values.shape[0] // n_columns
+    return values[:n_rows*n_columns].reshape((n_rows, n_columns))
+
+
+def _parse_gui(raw, meta):
+    offset = 0
+    while raw.startswith(b"#", offset):
+        (this_line,), offset = _split_lines(raw, 1, offset)
+        this_line = this_line.decode("utf-8", "replace")
+        for key in ("SAMPLE_SURFACE", "SAMPLE_NAME", "COATING_STEP", "TOTAL_CHARGE"):
+            res = this_line.split("# "+key+" = ")
+            if len(res) == 2:
+                meta[key.lower()] = res[1].strip()
+    if meta["sample_surface"] is not None:
+        meta["sample_surface"] = float(meta["sample_surface"])
+    if meta["total_charge"] is not None:
+        meta["total_charge"] = float(meta["total_charge"])
+    columns = parse_body(raw[offset:])
+    if columns.shape[1] == 3:
+        return columns
+    # some early test files hold less columns
+    data = _np.full((columns.shape[0], 3), _np.nan)
+    n_columns = min(columns.shape[1], 3)
+    data[:, :n_columns] = columns[:, :n_columns]
+    return data
+
+
+def _parse_labview(raw, meta):
+    (stamp, names, units), offset = _split_lines(raw, 3)
+    start = _datetime.datetime.fromisoformat(stamp.decode())
+    meta["start_time"] = start.timestamp()
+    columns = parse_body(raw[offset:], len(names.split()))
+    data = _np.full((columns.shape[0], 3), _np.nan)
+    data[:, 0] = columns[:, 0] + meta["start_time"]
+    data[:, 1] = columns[:, 1]
+    return data
+
+
+def _parse_spill(raw, meta):
+    data = parse_body(raw, 3)
+    return data[:, (0, 2, 1)]
+
+
+def load(filename):
+    """Load any supported file, returns (data, metadata).
+
+    metadata holds sample_surface, sample_name, coating_step and
+    total_charge as far as the layout stores them, the detected format and the start_time (UNIX
+    time of the first sample, None without data).
+    """
+    with open(filename, "rb") as f_in:
+        head = f_in.read(len(_sf.MAGIC))
+        file_format = detect_format(head)
+        if file_format in ("session", "journal"):
+            raw = None
+        else:
+            raw = head + f_in.read()
+            file_format = detect_format(raw[:256])
+
+    meta = _sf.metadata()
+    meta["start_time"] = None
+    if file_format == "session":
+        data, stored = _sf.load(filename)
+        meta.update(stored)
+    elif file_format == "journal":
+        data, stored = _jnl.read(filename)
+        meta.update(stored)
+    elif file_format == "gui":
+        data = _parse_gui(raw, meta)
+    elif file_format == "labview":
+        data = _parse_labview(raw, meta)
+    elif file_format == "spill":
+        data = _parse_spill(raw, meta)
+    else:
+        data = _np.empty((0, 3))
+
+    meta["format"] = file_format
+    if data.shape[0]:
+        meta["start_time"] = float(data[0, 0])
+    return data, meta
+
+
+def list_files(directory):
+    """All regular, non-hidden data files of directory, sorted by name"""
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if not name.startswith(".") and not name.endswith(IGNORED_EXTENSIONS)
+                  and os.path.isfile(os.path.join(directory, name)))
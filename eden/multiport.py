@@ -0,0 +1,238 @@
+"""
+Concurrent acquisition from several PSC boards in one thread.
+
+Instead of a thread per board blocking on its port, the Multiplexer writes
+a measurement round to every board and afterwards only reads the bytes a
+port already holds (in_waiting), so a slow board never holds up the others.
+Each board starts its next round as soon as the previous one is complete,
+i.e. runs at its own pace however many boards are added. All samples are
+timestamped on the shared clock of eden.clock. A Board is an
+eden.acquisition.Acquisition otherwise, with its commands, setpoint
+program, target and publishers.
+
+Usage:
+    python -m eden.multiport COM3:1,2 COM4:1 [--duration S] [--name NAME]
+                             [--step STEP] [--surface CM2] [--simulate]
+                             [--interval S] [--deadband-voltage V]
+                             [--deadband-current A] [--max-interval S]
+
+Every board and channel is recorded to its own crash journal, which is
+turned into a session file (<start>_<port>_ch<n>.eden) at the end, next to
+the telemetry of each board (<start>_<port>.telemetry.json). A port
+sim://NAME[?options] is a simulated board, see eden.fake_serial, e.g.
+sim://A?virtual=1 records a simulated --duration in a fraction of the time.
+"""
+
+import argparse
+import os
+import re
+import time
+
+from eden import Class_PSC as _psc
+from eden import acquisition as _acq
+from eden import clock as _clock
+from eden import journal as _jnl
+from eden import session_file as _sf
+from eden import telemetry as _tel
+
+
+class Board(_acq.Acquisition):
+    """Acquisition of one PSC with non-blocking measurement rounds.
+
+    The commands, the program, the target, the recording and the
+    publishers are those of eden.acquisition, only a round is written by
+    start_round() and its replies collected by feed() instead of waiting
+    for them.
+    """
+
+    def __init__(self, psc, sample_interval=None, deadband=None, align_voltage=False):
+        _acq.Acquisition.__init__(self, psc)
+        self.sample_interval = sample_interval
+        self.deadband = deadband
+        self.align_voltage = align_voltage
+        self.filename_root = None
+        self.n_rounds = 0
+        self.deadline = None
+        self._round = None
+        self._answers = []
+        self._times = []
+
+    @property
+    def busy(self):
+        return self._round is not None
+
+    def record(self, filename_root, sample_info, flush_interval=1.0):
+        """Journal the samples of every channel to <filename_root>_ch<n>.edj"""
+        self.filename_root = filename_root
+        self.sample_info = sample_info
+        self.journal_interval = flush_interval
+        self.is_recording = True
+
+    def journal_filename(self, channel):
+        return self.filename_root+"_ch"+str(channel)+_jnl.EXTENSION
+
+    def close(self):
+        self.is_recording = False
+        self.close_journal()
+
+    def start_round(self):
+        """Write the next round if it is due, returns True if it was"""
+        # queued commands (setpoints, ...) and the program are sent between
+        # two rounds, when no reply of the board is outstanding
+        self.commands.run_pending()
+        self.run_program()
+        now = _clock.now()
+        channels = self.due_channels(now)
+        if not channels:
+            return False
+        self.begin_round(now)
+        channels, commands = self.psc.channel_round(channels)
+        self.psc.serial_conn.write(b"".join(command.encode()+b"\n" for command in commands))
+        self._round = (channels, commands)
+        self._answers = []
+        self._requested = _clock.now()
+        self._times = []
+        self.deadline = self._requested + self.psc.response_timeout
+        return True
+
+    def feed(self):
+        """Read what the port holds, returns True once the round is complete"""
+        answers = self.psc.frames.read_available()
+        answered = _clock.now()
+        for answer in answers:
+            if len(self._answers) == len(self._round[1]):
+                # stray replies beyond the round are dropped
+                break
+            # as in PSC.query(), the board takes on the next query once
+            # this one is answered
+            command = self._round[1][len(self._answers)]
+            self.psc.telemetry.record_round_trip(command, answered - self._requested)
+            self._answers.append(answer)
+            self._times.append((self._requested, answered))
+            self._requested = answered
+        return len(self._answers) >= len(self._round[1])
+
+    def finish_round(self, timestamp):
+        """Store the readings of the round, returns the measured channels"""
+        channels, commands = self._round
+        self._round = None
+        if len(self._answers) < len(commands):
+            # timed out: as in PSC.query() the replies after a lost one are
+            # shifted, the whole round is missing (the readings keep their
+            # last value) and late replies must not end up in the next round
+            self.psc.serial_conn.reset_input_buffer()
+            self.psc.frames.reset()
+            self.psc.telemetry.count("timeouts")
+            self._answers = [None] * len(commands)
+            self._times = [(self._requested, timestamp)] * len(commands)
+        self.psc.store_channel_round(channels, commands, self._answers, self._times)
+        self.end_round(channels)
+        self.n_rounds += 1
+        return channels
+
+
+class Multiplexer:
+    """Polls several boards concurrently from a single thread"""
+
+    def __init__(self, boards, poll_interval=0.001):
+        self.boards = list(boards)
+        self.poll_interval = poll_interval
+
+    def step(self):
+        """Serve every board once without blocking, returns the completed rounds"""
+        n_completed = 0
+        for board in self.boards:
+            if not board.busy:
+                board.start_round()
+            elif board.feed() or _clock.now() > board.deadline:
+                board.finish_round(_clock.now())
+                n_completed += 1
+        return n_completed
+
+    def run(self, stop=lambda: False):
+        """Poll until stop() returns True"""
+        while not stop():
+            if not self.step():
+                _clock.sleep(self.poll_interval)
+
+
+def parse_board(spec):
+    """(port, [channels]) of a board given as PORT:CH[,CH...] (default channel 1)"""
+    port, _, channels = spec.rpartition(":")
+    if not port:
+        return channels, [1]
+    return port, [int(channel) for channel in channels.split(",")]
+
+
+def connect(port, channels):
+
+    psc = _psc.PSC(port, channels[0], channels[1:])
+    psc.establish_connection()
+    psc.activate_chan()
+    return psc
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record several PSC boards concurrently")
+    parser.add_argument("boards", nargs="+", help="PORT:CH[,CH...], e.g. COM3:1,2")
+    parser.add_argument("--duration", type=float, default=None, help="seconds (default: until Ctrl+C)")
+    parser.add_argument("--surface", type=float, default=None, help="sample surface (cm^2)")
+    parser.add_argument("--name", default="", help="sample name")
+    parser.add_argument("--step", default="", help="coating step")
+    parser.add_argument("--simulate", action="store_true", help="use the simulated board")
+    parser.add_argument("--interval", type=float, default=None,
+                        help="poll interval (s), default: as fast as possible")
+    parser.add_argument("--deadband-voltage", type=float, default=None,
+                        help="store a sample when the voltage changed by more (V)")
+    parser.add_argument("--deadband-current", type=float, default=None,
+                        help="store a sample when the current changed by more (A)")
+    parser.add_argument("--max-interval", type=float, default=None,
+                        help="store a sample at least this often (s)")
+    parser.add_argument("--align-voltage", action="store_true",
+                        help="interpolate the voltage to the time of the current")
+    args = parser.parse_args()
+
+    if args.simulate:
+        from eden import fake_serial
+        _psc.serial = fake_serial
+    sample_info = _sf.metadata(args.surface, args.name, args.step)
+    start = time.strftime("%Y%m%d_%H%M%S", time.gmtime())
+    deadband = (args.deadband_voltage, args.deadband_current, args.max_interval)
+    boards = []
+    for spec in args.boards:
+        port, channels = parse_board(spec)
+        board = Board(connect(port, channels), args.interval, deadband, args.align_voltage)
+        board.record(start+"_"+re.sub(r"\W", "_", port).strip("_"), sample_info)
+        boards.append(board)
+
+    start_time = _clock.now()
+    if args.duration is None:
+        stop = lambda: False
+    else:
+        stop = lambda: _clock.now() - start_time > args.duration
+    try:
+        Multiplexer(boards).run(stop)
+    except KeyboardInterrupt:
+        pass
+    elapsed = _clock.now() - start_time
+
+    for board in boards:
+        journals = list(board.journals.values())
+        board.close()
+        board.psc.close_connection()
+        print(board.psc.port+": "+str(board.n_rounds)+" rounds, %.2f rounds/s" % (board.n_rounds/elapsed))
+        print("  "+board.psc.telemetry.status_text())
+        board.psc.telemetry.export(board.filename_root+_tel.EXTENSION, port=board.psc.port,
+                                   channels=board.psc.channels)
+        for channel, recorder in board.recorders.items():
+            print("  ch"+str(channel)+": stored "+str(recorder.filter.n_stored)+" of "
+                  +str(recorder.filter.n_samples)+" samples, charge %.6g C" % recorder.charge)
+        for journal in journals:
+            filename = os.path.splitext(journal.filename)[0]+_sf.EXTENSION
+            n_rows = _jnl.recover(journal.filename, filename)
+            os.remove(journal.filename)
+            print("  "+str(n_rows)+" samples in "+filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Timed setpoint programs and the log of the applied setpoints.
+
+A program is a list of segments, as loaded from a JSON file:
+    {"type": "step", "voltage": 5.0, "current": 1.0, "duration": 60}
+    {"type": "ramp", "voltage": 5.0, "current": [0.0, 2.0], "duration": 30,
+     "interval": 0.1}
+    {"type": "pulse", "phases": [[5.0, 1.0, 0.01], [5.0, -2.0, 0.002]],
+     "cycles": 1000}
+A ramp changes the voltage and current ([start, end], a single value stays
+constant) linearly in steps of interval seconds (default RAMP_INTERVAL). A
+pulse repeats its phases ([voltage, current, seconds]) cycles times, a
+negative current gives a reverse pulse. The program holds the setpoints of
+its last segment once it ended.
+
+ProgramRunner runs the events of a program (events()) on the thread that
+owns the serial port (eden.acquisition): the acquisition holds back a
+measurement round that would delay the next due setpoint and sleeps until
+it, instead of finding the setpoint late after the round. Within a pulse
+train only the channel of the program is measured, when it fits between two
+phases. If several setpoints are due at once only the latest one is written.
+
+SetpointLog keeps every setpoint written to the board, with the time it was
+written and, for program setpoints, the time it was scheduled for. The
+difference is the timing jitter, whose histogram is part of the log;
+export() writes everything as JSON next to the saved session.
+"""
+
+import argparse
+import json
+import threading as _th
+
+from eden import telemetry as _tel
+
+EXTENSION = ".setpoints.json"
+# step (s) of a ramp without interval
+RAMP_INTERVAL = 0.1
+# upper bin edges (s) of the jitter histogram, the last bin is open
+JITTER_BINS = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5)
+# number of jitter values kept for the percentiles
+JITTER_WINDOW = 100000
+
+
+def _duration(value):
+    seconds = float(value)
+    if seconds < 0:
+        raise ValueError("Program durations must not be negative")
+    return seconds
+
+
+def _span(value):
+    # (start, end) of a ramp value
+    if isinstance(value, (list, tuple)):
+        start, end = value
+        return float(start), float(end)
+    return float(value), float(value)
+
+
+def _program(segments):
+    # setpoints (possibly several at one offset) and pulse trains of a program
+    program = []
+    trains = []
+    offset = 0.
+    for segment in segments:
+        kind = segment.get("type")
+        if kind == "step":
+            program.append((offset, float(segment["voltage"]), float(segment["current"])))
+            offset += _duration(segment["duration"])
+        elif kind == "ramp":
+            duration = _duration(segment["duration"])
+            (v_start, v_end), (i_start, i_end) = _span(segment["voltage"]), _span(segment["current"])
+            interval = float(segment.get("interval", RAMP_INTERVAL))
+            if interval <= 0:
+                raise ValueError("The ramp interval must be positive")
+            n_steps = max(int(round(duration / interval)), 1)
+            for step in range(n_steps + 1):
+                fraction = step / n_steps
+                program.append((offset + fraction * duration,
+                                v_start + fraction * (v_end - v_start),
+                                i_start + fraction * (i_end - i_start)))
+            offset += duration
+        elif kind == "pulse":
+            phases = [(float(voltage), float(current), _duration(seconds))
+                      for voltage, current, seconds in segment["phases"]]
+            start = offset
+            for _ in range(int(segment.get("cycles", 1))):
+                for voltage, current, seconds in phases:
+                    program.append((offset, voltage, current))
+                    offset += seconds
+            if offset > start:
+                trains.append((start, offset, min(seconds for _, _, seconds in phases)))
+        else:
+            raise ValueError("Unknown program segment "+str(kind))
+    return program, trains
+
+
+def events(segments):
+    """(offset (s), voltage, current) of every setpoint of a program, in time order"""
+    program, _ = _program(segments)
+    # a segment starting where a ramp ends replaces its last setpoint
+    return [event for i, event in enumerate(program)
+            if i + 1 == len(program) or program[i + 1][0] != event[0]]
+
+
+def pulse_trains(segments):
+    """(start offset, end offset, shortest phase) (s) of every pulse segment of a program"""
+    return _program(segments)[1]
+
+
+def load(filename):
+    """Segments of a program file"""
+    with open(filename) as f_in:
+        segments = json.load(f_in)
+    events(segments)
+    return segments
+
+
+class SetpointLog:
+    """Every setpoint written to the board and the jitter of the scheduled ones"""
+
+    def __init__(self):
+        self._lock = _th.Lock()
+        self.entries = []
+        self.reset()
+
+    def reset(self):
+        """Start over, keeping the setpoints in force on every channel"""
+        with self._lock:
+            last = {}
+            for entry in self.entries:
+                last[entry["channel"]] = dict(entry, scheduled=None)
+            self.entries = list(last.values())
+            self.jitter = _tel.RollingHistogram(JITTER_BINS, JITTER_WINDOW)
+            self.n_skipped = 0
+
+    def add(self, applied, channel, voltage, current, scheduled=None):
+        with self._lock:
+            self.entries.append({"applied": applied, "scheduled": scheduled, "channel": channel,
+                                 "voltage": voltage, "current": current})
+            if scheduled is not None:
+                self.jitter.add(applied - scheduled)
+
+    def skip(self, n=1):
+        """Count scheduled setpoints replaced by a later one before they were written"""
+        with self._lock:
+            self.n_skipped += n
+
+    def summary(self):
+        with self._lock:
+            return {"n_setpoints": len(self.entries),
+                    "n_skipped": self.n_skipped,
+                    "jitter": self.jitter.summary()}
+
+    def export(self, filename, **info):
+        """Write the setpoints, the jitter (and any extra info) as JSON"""
+        log = self.summary()
+        with self._lock:
+            log["setpoints"] = list(self.entries)
+        log.update(info)
+        with open(filename, "w") as f_out:
+            json.dump(log, f_out, indent=2)
+
+
+class ProgramRunner:
+    """Events of a program on one channel, from start_time on"""
+
+    def __init__(self, segments, channel, start_time):
+        self.segments = segments
+        self.events = events(segments)
+        self.pulse_trains = pulse_trains(segments)
+        self.channel = channel
+        self.start_time = start_time
+        self.position = 0
+        self.stopped = False
+        # (voltage, current) written last, unchanged values are not written again
+        self.written = (None, None)
+
+    @property
+    def finished(self):
+        return self.stopped or self.position >= len(self.events)
+
+    @property
+    def next_time(self):
+        """Time the next setpoint is due, None once finished"""
+        if self.finished:
+            return None
+        return self.start_time + self.events[self.position][0]
+
+    @property
+    def in_pulse(self):
+        """True if the next setpoint starts, continues or ends a pulse train"""
+        if self.finished:
+            return False
+        offset = self.events[self.position][0]
+        return any(start <= offset <= end for start, end, _ in self.pulse_trains)
+
+    @property
+    def shortest_phase(self):
+        """Shortest pulse phase (s), None without pulses"""
+        return min((phase for _, _, phase in self.pulse_trains), default=None)
+
+    def pop_due(self, now):
+        """(scheduled time, voltage, current) of the latest due setpoint (None if
+        nothing is due) and the number of earlier ones it replaces"""
+        position = self.position
+        while position < len(self.events) and self.start_time + self.events[position][0] <= now:
+            position += 1
+        if position == self.position:
+            return None, 0
+        n_skipped = position - self.position - 1
+        self.position = position
+        offset, voltage, current = self.events[position - 1]
+        return (self.start_time + offset, voltage, current), n_skipped
+
+    def summary(self):
+        return {"channel": self.channel,
+                "start_time": self.start_time,
+                "n_events": len(self.events),
+                "n_applied": self.position,
+                "duration": self.events[-1][0] if self.events else 0.,
+                "stopped": self.stopped,
+                "finished": self.finished}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the setpoints of a program file")
+    parser.add_argument("filename", help="JSON program")
+    args = parser.parse_args()
+
+    for offset, voltage, current in events(load(args.filename)):
+        print("%.4f\t%g\t%g" % (offset, voltage, current))
+
+
+if __name__ == "__main__":
+    main()
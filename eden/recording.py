@@ -0,0 +1,160 @@
+"""
+Poll scheduling and deadband recording.
+
+PollSchedule paces the measurements at a fixed interval. The polls are due
+on a fixed grid of multiples of the interval, so the rate does not drift by
+the time a measurement takes. A poll that is late by more than an interval
+skips the missed slots instead of catching up in a burst.
+
+DeadbandFilter decides which samples get stored: a sample is kept when its
+voltage or current differs from the last stored one by more than the
+tolerance, or when max_interval has passed since. On a change the last
+skipped sample is kept as well, so steps stay steps. The charge is
+integrated over every sample, stored or not (trapezoid rule as in
+eden.analysis), and stays exact.
+
+The board measures voltage and current one after the other, each reading
+is timestamped with the midpoint of its query. A row takes the time of its
+current reading; VoltageAligner optionally interpolates the voltage to that
+time. ChannelRecorder chains both for one channel.
+"""
+
+
+class PollSchedule:
+    """Drift-free schedule of polls every interval seconds"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_time = None
+
+    def remaining(self, now):
+        """Seconds until the next poll is due, <= 0 if it is due"""
+        if self.next_time is None:
+            return 0.
+        return self.next_time - now
+
+    def advance(self, now):
+        """Schedule the poll after the one started at now"""
+        if self.next_time is None:
+            self.next_time = now
+        n_slots = max(int((now - self.next_time) // self.interval), 0) + 1
+        self.next_time += n_slots * self.interval
+
+
+class DeadbandFilter:
+    """Change based selection of the (time, current, voltage) samples to store.
+
+    A tolerance of None does not check that quantity, without any
+    tolerance and max_interval every sample is stored.
+    """
+
+    def __init__(self, voltage_tolerance=None, current_tolerance=None, max_interval=None):
+        self.voltage_tolerance = voltage_tolerance
+        self.current_tolerance = current_tolerance
+        self.max_interval = max_interval
+        self.charge = 0.
+        self.n_samples = 0
+        self.n_stored = 0
+        self._last = None
+        self._stored = None
+
+    @property
+    def enabled(self):
+        return (self.voltage_tolerance is not None or self.current_tolerance is not None
+                or self.max_interval is not None)
+
+    def _changed(self, row):
+        stored = self._stored
+        return ((self.current_tolerance is not None
+                 and abs(row[1] - stored[1]) > self.current_tolerance)
+                or (self.voltage_tolerance is not None
+                    and abs(row[2] - stored[2]) > self.voltage_tolerance))
+
+    def add(self, row):
+        """Process a sample, returns the list of rows to store"""
+        previous, self._last = self._last, row
+        self.n_samples += 1
+        if previous is not None:
+            self.charge += (row[0] - previous[0]) * (row[1] + previous[1]) / 2.
+        if self._stored is None or not self.enabled:
+            return self._store([row])
+        if self._changed(row):
+            if previous is not self._stored:
+                return self._store([previous, row])
+            return self._store([row])
+        if self.max_interval is not None and row[0] - self._stored[0] >= self.max_interval:
+            return self._store([row])
+        return []
+
+    def finish(self):
+        """Rows still to store at the end of the recording (the last sample)"""
+        if self._last is None or self._last is self._stored:
+            return []
+        return self._store([self._last])
+
+    def _store(self, rows):
+        self._stored = rows[-1]
+        self.n_stored += len(rows)
+        return rows
+
+
+class VoltageAligner:
+    """Voltage readings interpolated to the time of the current readings.
+
+    The voltage is interpolated linearly between the voltage readings
+    before and after the current reading, so a row is only complete once
+    the voltage of the next round arrived.
+    """
+
+    def __init__(self):
+        self._pending = None
+
+    def add(self, voltage_time, voltage, current_time, current):
+        """Process the readings of a round, returns the completed rows"""
+        rows = []
+        if self._pending is not None:
+            last_voltage_time, last_voltage, last_current_time, last_current = self._pending
+            if voltage_time != last_voltage_time:
+                last_voltage += ((voltage - last_voltage) * (last_current_time - last_voltage_time)
+                                 / (voltage_time - last_voltage_time))
+            rows.append((last_current_time, last_current, last_voltage))
+        self._pending = (voltage_time, voltage, current_time, current)
+        return rows
+
+    def finish(self):
+        """The last row, with the voltage as measured"""
+        if self._pending is None:
+            return []
+        _, voltage, current_time, current = self._pending
+        self._pending = None
+        return [(current_time, current, voltage)]
+
+
+class ChannelRecorder:
+    """Rows to store of one channel: optional voltage alignment, then deadband"""
+
+    def __init__(self, deadband=None, align_voltage=False):
+        self.filter = DeadbandFilter(*(deadband or ()))
+        self.aligner = VoltageAligner() if align_voltage else None
+
+    @property
+    def charge(self):
+        """Exact charge (C) of all readings so far"""
+        return self.filter.charge
+
+    def add(self, voltage_time, voltage, current_time, current):
+        """Process the readings of a round, returns the rows to store"""
+        if self.aligner is None:
+            return self.filter.add((current_time, current, voltage))
+        rows = []
+        for row in self.aligner.add(voltage_time, voltage, current_time, current):
+            rows.extend(self.filter.add(row))
+        return rows
+
+    def finish(self):
+        """Rows still to store at the end of the recording"""
+        rows = []
+        if self.aligner is not None:
+            for row in self.aligner.finish():
+                rows.extend(self.filter.add(row))
+        return rows + self.filter.finish()
@@ -0,0 +1,72 @@
+"""
+Replay of a recorded run as a PSC board behind a serial port.
+
+Serial acts like the simulated board of eden.fake_serial (same timing model,
+commands and faults), but answers ME:VO? and ME:CU? with the rows of a
+recorded file (any layout eden.loader reads). Each measurement round of a
+channel takes the next row and the board holds the query until the row is
+due: at the recorded pace (speed=1), N times faster (speed=N) or, with
+speed=max, on a virtual clock as fast as the CPU allows. On the virtual
+clock the samples keep the spacing of the recording. The board has no
+processing time of its own by default, only the link (baudrate) limits how
+fast the rows can be served.
+
+PSC connects to it for ports like
+    replay://data/20190317_010941_sample2_sideA.dat?speed=max
+Once the recording is used up the board keeps reporting its last row.
+"""
+
+from eden import fake_serial as _sim
+from eden import loader as _loader
+
+SCHEME = "replay://"
+URL_OPTIONS = dict(_sim.URL_OPTIONS,
+                   speed=("speed", lambda value: None if value == "max" else float(value)))
+
+
+class Serial(_sim.Serial):
+    """Serial port of a board replaying a recorded file"""
+
+    def __init__(self, port, *args, speed=1., **kwargs):
+        if port.startswith(SCHEME):
+            port, options = _sim.parse_url(port, URL_OPTIONS)
+            speed = options.pop("speed", speed)
+            kwargs.update(options)
+        if speed is None:
+            kwargs["virtual"] = True
+        # the recording sets the pace, the board itself adds only the link
+        kwargs.setdefault("processing_time", 0.)
+        self.data, self.meta = _loader.load(port)
+        if not len(self.data):
+            raise ValueError(port+" holds no data to replay")
+        _sim.Serial.__init__(self, port, *args, **kwargs)
+        self.speed = speed or 1.
+        # the replay starts with the first measurement
+        self.start = None
+        # next row of every channel
+        self.positions = {}
+
+    @property
+    def finished(self):
+        """True once every channel reported the last row"""
+        return bool(self.positions) and min(self.positions.values()) >= len(self.data)
+
+    def _row(self):
+        return min(self.positions.get(self.channel, 0), len(self.data) - 1)
+
+    def hold_until( self, command, start ):
+        if command not in ("ME:VO?", "ME:CU?"):
+            return 0.
+        if self.start is None:
+            self.start = start
+        return self.start + (self.data[self._row(), 0] - self.data[0, 0]) / self.speed
+
+    def answer( self, command ):
+        if command not in ("ME:VO?", "ME:CU?"):
+            return _sim.Serial.answer(self, command)
+        row = self.data[self._row()]
+        if command == "ME:VO?":
+            return str(row[2]) + _sim.TERMINATOR.decode()
+        # the current ends the round of the channel
+        self.positions[self.channel] = self.positions.get(self.channel, 0) + 1
+        return str(row[1]) + _sim.TERMINATOR.decode()
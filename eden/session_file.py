@@ -0,0 +1,209 @@
+"""
+Binary session files (.eden) and the legacy text (.dat) layout.
+
+A session file starts with a fixed size header holding the sample metadata
+followed by the data in columnar order: all time stamps, then all currents,
+then all voltages, each as little-endian float64. load() maps the columns
+with np.memmap, so nothing has to be parsed. to_dat() and from_dat()
+convert losslessly between both layouts.
+
+The header also holds the total charge of the run as integrated while it
+was recorded (since version 2). With deadband recording it covers the
+samples that were not stored, so it is exact where the integral of the
+stored rows is not.
+
+Usage:
+    python -m eden.session_file to-dat session.eden [out.dat]
+    python -m eden.session_file from-dat legacy.dat [out.eden]
+"""
+
+import argparse
+import os
+import numpy as _np
+
+MAGIC = b"EDEN-SES"
+VERSION = 2
+EXTENSION = ".eden"
+COLUMNS = ("UNIX time", "Current (A)", "PS Voltage (V)", "REF Voltage (V)")
+
+HEADER_DTYPE = _np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("n_columns", "<u4"),
+    ("n_rows", "<u8"),
+    ("sample_surface", "<f8"),
+    ("sample_name", "S256"),
+    ("coating_step", "S64"),
+    ("total_charge", "<f8"),
+    ("reserved", "V152"),
+])
+DATA_DTYPE = _np.dtype("<f8")
+
+
+def metadata(sample_surface=None, sample_name="", coating_step="", total_charge=None):
+    """Metadata dict as returned by the load functions"""
+    return {"sample_surface": sample_surface,
+            "sample_name": sample_name,
+            "coating_step": coating_step,
+            "total_charge": total_charge}
+
+
+def _encode(text, size, what):
+    encoded = text.encode("utf-8")
+    if len(encoded) > size:
+        raise ValueError(what+" is longer than "+str(size)+" bytes")
+    return encoded
+
+
+def is_session_file(filename):
+    """True if filename starts with the session file magic"""
+    with open(filename, "rb") as f_in:
+        return f_in.read(len(MAGIC)) == MAGIC
+
+
+def make_header(n_columns, n_rows, sample_surface=None, sample_name="", coating_step="",
+                total_charge=None, magic=MAGIC):
+    """Header bytes of a session file (or of a journal, see eden.journal)"""
+    header = _np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = magic
+    header["version"] = VERSION
+    header["n_columns"] = n_columns
+    header["n_rows"] = n_rows
+    header["sample_surface"] = _np.nan if sample_surface is None else sample_surface
+    header["sample_name"] = _encode(sample_name, 256, "Sample name")
+    header["coating_step"] = _encode(coating_step, 64, "Coating step")
+    header["total_charge"] = _np.nan if total_charge is None else total_charge
+    return header.tobytes()
+
+
+def save(filename, data, sample_surface=None, sample_name="", coating_step="", total_charge=None):
+    """Write data (rows of time, current, voltage) to a binary session file"""
+    data = _np.asarray(data, dtype=DATA_DTYPE)
+    if data.ndim != 2:
+        data = _np.empty((0, 3), dtype=DATA_DTYPE)
+    header = make_header(data.shape[1], data.shape[0], sample_surface, sample_name, coating_step,
+                         total_charge)
+    # data may be mapped from filename itself (see load()), the file is
+    # only replaced once the new one is complete
+    with open(filename+".part", "wb") as f_out:
+        f_out.write(header)
+        # columnar: every column is contiguous on disk
+        f_out.write(_np.ascontiguousarray(data.T).tobytes())
+    os.replace(filename+".part", filename)
+
+
+def read_header(filename, magic=MAGIC):
+    """Header of a session file as a structured numpy scalar"""
+    header = _np.fromfile(filename, dtype=HEADER_DTYPE, count=1)
+    if not len(header) or header["magic"][0] != magic:
+        raise ValueError(filename+" is not an EDen session file")
+    if header["version"][0] > VERSION:
+        raise ValueError(filename+" was written by a newer EDen version")
+    return header[0]
+
+
+def load(filename):
+    """Map a session file, returns (data, metadata).
+
+    data is a read-only (n_rows, n_columns) view on the memory mapped
+    columns of the file.
+    """
+    header = read_header(filename)
+    n_rows = int(header["n_rows"])
+    n_columns = int(header["n_columns"])
+    if n_rows:
+        columns = _np.memmap(filename, dtype=DATA_DTYPE, mode="r",
+                             offset=HEADER_DTYPE.itemsize, shape=(n_columns, n_rows))
+        data = columns.T
+    else:
+        data = _np.empty((0, n_columns), dtype=DATA_DTYPE)
+    return data, header_metadata(header)
+
+
+def header_metadata(header):
+    """Metadata dict stored in a header"""
+    surface = float(header["sample_surface"])
+    # version 1 headers have zeros in place of the charge
+    charge = float(header["total_charge"]) if header["version"] >= 2 else _np.nan
+    return metadata(None if _np.isnan(surface) else surface,
+                    header["sample_name"].decode("utf-8"),
+                    header["coating_step"].decode("utf-8"),
+                    None if _np.isnan(charge) else charge)
+
+
+def dat_header(sample_surface=None, sample_name="", coating_step="", total_charge=None):
+    """Header of the legacy text layout, as written by np.savetxt"""
+    file_header = ", ".join(COLUMNS)+"\n"
+    if sample_surface is not None:
+        file_header += "SAMPLE_SURFACE = "+str(sample_surface)+"\n"
+    if sample_name:
+        file_header += "SAMPLE_NAME = "+sample_name+"\n"
+    if coating_step:
+        file_header += "COATING_STEP = "+coating_step+"\n"
+    if total_charge is not None:
+        file_header += "TOTAL_CHARGE = "+repr(float(total_charge))+"\n"
+    return file_header.rstrip("\n")
+
+
+def save_dat(filename, data, sample_surface=None, sample_name="", coating_step="",
+             total_charge=None):
+    """Write data in the legacy tab separated text layout"""
+    # the default '%.18e' format keeps every bit of the float64 values
+    _np.savetxt(filename, data, delimiter='\t',
+                header=dat_header(sample_surface, sample_name, coating_step, total_charge))
+
+
+def load_dat(filename):
+    """Read a legacy text file, returns (data, metadata)"""
+    meta = metadata()
+    n_header = 0
+    with open(filename, "r") as f_in:
+        for this_line in f_in:
+            if not this_line.startswith("#"):
+                break
+            n_header += 1
+            res1 = this_line.split("# SAMPLE_SURFACE = ")
+            res2 = this_line.split("# SAMPLE_NAME = ")
+            res3 = this_line.split("# COATING_STEP = ")
+            res4 = this_line.split("# TOTAL_CHARGE = ")
+            if len(res1) == 2:
+                meta["sample_surface"] = float(res1[1].strip())
+            if len(res2) == 2:
+                meta["sample_name"] = res2[1].strip()
+            if len(res3) == 2:
+                meta["coating_step"] = res3[1].strip()
+            if len(res4) == 2:
+                meta["total_charge"] = float(res4[1].strip())
+    data = _np.loadtxt(filename, delimiter='\t', skiprows=n_header, ndmin=2)
+    return data, meta
+
+
+def to_dat(src, dst):
+    """Convert a session file to the legacy text layout"""
+    data, meta = load(src)
+    save_dat(dst, data, **meta)
+
+
+def from_dat(src, dst):
+    """Convert a legacy text file to a session file"""
+    data, meta = load_dat(src)
+    save(dst, data, **meta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between EDen session files and the legacy .dat layout")
+    parser.add_argument("direction", choices=("to-dat", "from-dat"))
+    parser.add_argument("src")
+    parser.add_argument("dst", nargs="?")
+    args = parser.parse_args()
+    if args.direction == "to-dat":
+        dst = args.dst or os.path.splitext(args.src)[0]+".dat"
+        to_dat(args.src, dst)
+    else:
+        dst = args.dst or os.path.splitext(args.src)[0]+EXTENSION
+        from_dat(args.src, dst)
+    print("written "+dst)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Live sample stream of an acquisition to local subscribers.
+
+StreamServer sends every batch of stored samples as a binary frame to all
+connected subscribers, over TCP or a Unix socket. publish() only queues the
+frame: every subscriber has its own bounded queue and sender thread, so a
+slow subscriber never holds up the acquisition. Once a queue holds more
+than max_queued bytes its oldest frames are dropped; the row index of each
+frame shows the subscriber the gap.
+
+A frame is a header (FRAME: magic, channel, number of rows, index of the
+first row in the recording) followed by the rows (time, current, voltage)
+as little endian float64. The index starts at 0 with every recording.
+
+Usage, a subscriber writing the samples as text lines:
+    python -m eden.stream [tcp:HOST:PORT | unix:PATH]
+"""
+
+import argparse
+import collections
+import os
+import socket
+import struct
+import sys
+import threading as _th
+import numpy as _np
+
+MAGIC = b"EDSF"
+FRAME = struct.Struct("<4sHIQ")
+N_COLUMNS = 3
+ROW_DTYPE = _np.dtype("<f8")
+DEFAULT_ADDRESS = "tcp:127.0.0.1:7521"
+# bytes queued for a subscriber before its oldest frames are dropped
+MAX_QUEUED = 4 * 2**20
+
+
+def parse_address(text):
+    """(socket family, address) of tcp:HOST:PORT or unix:PATH"""
+    kind, _, address = text.partition(":")
+    if kind == "tcp":
+        host, _, port = address.rpartition(":")
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    if kind == "unix" and hasattr(socket, "AF_UNIX"):
+        return socket.AF_UNIX, address
+    raise ValueError("Stream addresses are tcp:HOST:PORT or unix:PATH, not "+text)
+
+
+def encode(channel, start, rows):
+    """Frame of rows of channel, the first one being row start of the recording"""
+    data = _np.asarray(rows, dtype=ROW_DTYPE).reshape((-1, N_COLUMNS))
+    return FRAME.pack(MAGIC, channel, data.shape[0], start) + data.tobytes()
+
+
+class _Subscriber:
+    """Queue and sender thread of one connection"""
+
+    def __init__(self, connection, max_queued):
+        self.connection = connection
+        self.max_queued = max_queued
+        self.frames = collections.deque()
+        self.n_queued = 0
+        self.n_sent = 0
+        self.n_dropped = 0
+        self.closed = False
+        self._ready = _th.Condition()
+        _th.Thread(target=self._send, name="eden.stream subscriber", daemon=True).start()
+
+    def put(self, frame):
+
+        with self._ready:
+            if self.closed:
+                return
+            self.frames.append(frame)
+            self.n_queued += len(frame)
+            while self.n_queued > self.max_queued and len(self.frames) > 1:
+                self.n_queued -= len(self.frames.popleft())
+                self.n_dropped += 1
+            self._ready.notify()
+
+    def _send(self):
+
+        while True:
+            with self._ready:
+                while not self.frames and not self.closed:
+                    self._ready.wait()
+                if self.closed:
+                    break
+                frame = self.frames.popleft()
+                self.n_queued -= len(frame)
+            try:
+                self.connection.sendall(frame)
+            except OSError:
+                # the subscriber went away
+                break
+            self.n_sent += 1
+        self.close()
+
+    def close(self):
+
+        with self._ready:
+            self.closed = True
+            self.frames.clear()
+            self._ready.notify()
+        try:
+            self.connection.close()
+        except OSError:
+            pass
+
+
+class StreamServer:
+    """Publishes sample batches to every connected subscriber"""
+
+    def __init__(self, address=DEFAULT_ADDRESS, max_queued=MAX_QUEUED):
+        self.address = address
+        self.max_queued = max_queued
+        family, self._address = parse_address(address)
+        if family == getattr(socket, "AF_UNIX", None) and os.path.exists(self._address):
+            os.remove(self._address)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(self._address)
+        self.socket.listen()
+        self.subscribers = []
+        self._lock = _th.Lock()
+        _th.Thread(target=self._accept, name="eden.stream server", daemon=True).start()
+
+    def _accept(self):
+
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                # closed
+                break
+            if connection.family == socket.AF_INET:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            subscriber = _Subscriber(connection, self.max_queued)
+            with self._lock:
+                self.subscribers = [other for other in self.subscribers
+                                    if not other.closed] + [subscriber]
+
+    def publish(self, channel, start, rows):
+        """Queue rows of channel (the first one is row start of the recording) for everyone"""
+        if not len(rows):
+            return
+        frame = encode(channel, start, rows)
+        for subscriber in self.subscribers:
+            subscriber.put(frame)
+
+    def stats(self):
+        """Sent, dropped and queued frames of every subscriber"""
+        return [{"n_sent": subscriber.n_sent,
+                 "n_dropped": subscriber.n_dropped,
+                 "n_queued_bytes": subscriber.n_queued}
+                for subscriber in self.subscribers if not subscriber.closed]
+
+    def close(self):
+
+        self.socket.close()
+        for subscriber in self.subscribers:
+            subscriber.close()
+        if self.socket.family == getattr(socket, "AF_UNIX", None):
+            try:
+                os.remove(self._address)
+            except OSError:
+                pass
+
+
+class Subscription:
+    """Frames of a StreamServer"""
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        family, address = parse_address(address)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(address)
+        self._file = self.socket.makefile("rb")
+
+    def read(self):
+        """(channel, start, rows) of the next frame, None once the stream ended"""
+        header = self._file.read(FRAME.size)
+        if len(header) < FRAME.size:
+            return None
+        magic, channel, n_rows, start = FRAME.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("Not an EDen sample stream")
+        data = self._file.read(n_rows * N_COLUMNS * ROW_DTYPE.itemsize)
+        if len(data) < n_rows * N_COLUMNS * ROW_DTYPE.itemsize:
+            return None
+        return channel, start, _np.frombuffer(data, dtype=ROW_DTYPE).reshape((n_rows, N_COLUMNS))
+
+    def __iter__(self):
+        frame = self.read()
+        while frame is not None:
+            yield frame
+            frame = self.read()
+
+    def close(self):
+        self._file.close()
+        self.socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the live samples of a stream as text")
+    parser.add_argument("address", nargs="?", default=DEFAULT_ADDRESS,
+                        help="tcp:HOST:PORT or unix:PATH (default "+DEFAULT_ADDRESS+")")
+    args = parser.parse_args()
+
+    subscription = Subscription(args.address)
+    expected = {}
+    try:
+        for channel, start, rows in subscription:
+            if start > expected.get(channel, start):
+                sys.stderr.write("ch%d: %d rows dropped\n" % (channel, start - expected[channel]))
+            expected[channel] = start + len(rows)
+            for row in rows.tolist():
+                sys.stdout.write("%d\t%r\t%r\t%r\n" % (channel, row[0], row[1], row[2]))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    subscription.close()
+
+
+if __name__ == "__main__":
+    main()
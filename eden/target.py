@@ -0,0 +1,109 @@
+"""
+Automatic stop of a coating at a target charge, mass or thickness.
+
+The target is converted to the charge (C) it takes with the functions of
+eden.analysis: a copper mass (g) directly, a layer thickness (cm) on the
+sample surface (cm^2). The acquisition thread hands every current reading
+of the channel to TargetStop.add(), which integrates it (trapezoid rule, as
+eden.recording) and tells when the magnitude of the charge reaches the
+target, so plating with a negative current stops as well. The acquisition
+then zeroes the setpoints of the channel right away.
+
+The time the target was reached is interpolated between the two readings
+around it; the stop latency is the time from there until the zero
+setpoints were written to the board. export() saves both next to the
+session.
+"""
+
+import json
+import math
+
+from eden import analysis as _ana
+
+KINDS = ("charge", "mass", "thickness")
+EXTENSION = ".target.json"
+
+
+def target_charge(kind, value, surface=None):
+    """Charge (C) of a target charge (C), mass (g) or thickness (cm) on surface (cm^2)"""
+    if kind not in KINDS:
+        raise ValueError("Unknown target "+str(kind))
+    if value <= 0:
+        raise ValueError("The target must be positive")
+    if kind == "charge":
+        return value
+    if kind == "thickness":
+        if not surface:
+            raise ValueError("A thickness target needs the sample surface")
+        value = value * _ana.DENSITY_CU * surface
+    # the mass is proportional to the charge
+    return value / _ana.deposited_mass(1.)
+
+
+class TargetStop:
+    """Charge integrated reading by reading until it reaches a target"""
+
+    def __init__(self, charge, channel=None, end_recording=True):
+        self.target = abs(charge)
+        # None: the channel of the recording (psc.channel)
+        self.channel = channel
+        # the recording ends with the stop as well
+        self.end_recording = end_recording
+        self.reset()
+
+    def reset(self):
+        self.charge = 0.
+        self._last = None
+        # time the target was reached, it was seen and the output was zeroed
+        self.reached_time = None
+        self.detected_time = None
+        self.stopped_time = None
+
+    @property
+    def reached(self):
+        return self.reached_time is not None
+
+    @property
+    def latency(self):
+        """Seconds from reaching the target to the zero setpoints, None before"""
+        if self.stopped_time is None:
+            return None
+        return self.stopped_time - self.reached_time
+
+    def add(self, current_time, current):
+        """Integrate a current reading, returns True when it reaches the target"""
+        if self.reached:
+            return False
+        # a reading that never arrived (NaN) is skipped, the next one is
+        # integrated over the gap
+        if not (math.isfinite(current_time) and math.isfinite(current)):
+            return False
+        last, self._last = self._last, (current_time, current)
+        if last is None:
+            return False
+        last_time, last_current = last
+        before = abs(self.charge)
+        self.charge += (current_time - last_time) * (current + last_current) / 2.
+        after = abs(self.charge)
+        if after < self.target:
+            return False
+        fraction = (self.target - before) / (after - before) if after > before else 1.
+        self.reached_time = last_time + min(max(fraction, 0.), 1.) * (current_time - last_time)
+        return True
+
+    def summary(self):
+        """Target, charge and stop timing as a dict"""
+        return {"target_charge": self.target,
+                "channel": self.channel,
+                "charge": self.charge,
+                "reached_time": self.reached_time,
+                "detected_time": self.detected_time,
+                "stopped_time": self.stopped_time,
+                "latency": self.latency}
+
+    def export(self, filename, **info):
+        """Write the summary (and any extra info) as JSON"""
+        summary = self.summary()
+        summary.update(info)
+        with open(filename, "w") as f_out:
+            json.dump(summary, f_out, indent=2)
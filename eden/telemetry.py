@@ -0,0 +1,134 @@
+"""
+Telemetry of the serial link to a PSC board.
+
+Every PSC driver keeps a Telemetry object with rolling histograms of the
+round-trip time of each command, counters of unparseable replies, read
+timeouts and stale samples (a reading that kept its previous value) and
+the achieved sample rate. status_text() is shown in the GUI status bar,
+export() writes everything as JSON next to the saved session.
+"""
+
+import bisect
+import collections
+import json
+import threading as _th
+
+from eden import clock as _clock
+
+# upper bin edges (s) of the round-trip histograms, the last bin is open
+LATENCY_BINS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1., 2., 5.)
+# number of round-trips per command kept in the rolling window
+WINDOW = 1000
+# time span (s) of the sample rate
+RATE_WINDOW = 10.
+COUNTERS = ("parse_errors", "timeouts", "stale_samples")
+EXTENSION = ".telemetry.json"
+
+
+class RollingHistogram:
+    """Histogram and percentiles of the last window values"""
+
+    def __init__(self, bins=LATENCY_BINS, window=WINDOW):
+        self.bins = bins
+        self.values = collections.deque(maxlen=window)
+        self.counts = [0] * (len(bins) + 1)
+        self.n_total = 0
+
+    def add(self, value):
+        if len(self.values) == self.values.maxlen:
+            self.counts[bisect.bisect_left(self.bins, self.values[0])] -= 1
+        self.values.append(value)
+        self.counts[bisect.bisect_left(self.bins, value)] += 1
+        self.n_total += 1
+
+    def percentile(self, fraction):
+        if not self.values:
+            return None
+        ordered = sorted(self.values)
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+    def summary(self):
+        return {"n_total": self.n_total,
+                "n_window": len(self.values),
+                "mean_s": sum(self.values) / len(self.values) if self.values else None,
+                "p50_s": self.percentile(0.5),
+                "p99_s": self.percentile(0.99),
+                "max_s": max(self.values) if self.values else None,
+                "bins_s": list(self.bins),
+                "counts": list(self.counts)}
+
+
+class Telemetry:
+    """Round-trip times, error counters and sample rate of one board"""
+
+    def __init__(self, clock=_clock.now):
+        self._lock = _th.Lock()
+        self._clock = clock
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = self._clock()
+            self.round_trips = {}
+            self.counters = dict.fromkeys(COUNTERS, 0)
+            self.n_samples = 0
+            self._sample_times = collections.deque()
+
+    def record_round_trip(self, command, seconds):
+        # queries differ by their arguments only for setters, keep the name
+        name = command.split(" ", 1)[0]
+        with self._lock:
+            if name not in self.round_trips:
+                self.round_trips[name] = RollingHistogram()
+            self.round_trips[name].add(seconds)
+
+    def count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def record_sample(self, n=1):
+        now = self._clock()
+        with self._lock:
+            self.n_samples += n
+            self._sample_times.append((now, n))
+            while self._sample_times[0][0] < now - RATE_WINDOW:
+                self._sample_times.popleft()
+
+    def sample_rate(self):
+        """Samples per second over the last RATE_WINDOW seconds"""
+        now = self._clock()
+        with self._lock:
+            recent = [n for sample_time, n in self._sample_times if sample_time >= now - RATE_WINDOW]
+            span = min(RATE_WINDOW, now - self.started)
+        return sum(recent) / span if span > 0 else 0.
+
+    def snapshot(self):
+        """All telemetry as a JSON serializable dict"""
+        rate = self.sample_rate()
+        with self._lock:
+            return {"started": self.started,
+                    "time": self._clock(),
+                    "n_samples": self.n_samples,
+                    "samples_per_s": rate,
+                    "counters": dict(self.counters),
+                    "round_trips": {name: histogram.summary()
+                                    for name, histogram in sorted(self.round_trips.items())}}
+
+    def status_text(self):
+        """One line summary for the status bar"""
+        snapshot = self.snapshot()
+        latencies = [summary["p50_s"] for summary in snapshot["round_trips"].values()
+                     if summary["p50_s"] is not None]
+        text = "%.1f samples/s" % snapshot["samples_per_s"]
+        if latencies:
+            text += ", RTT %.0f ms" % (max(latencies) * 1E3)
+        counters = snapshot["counters"]
+        return (text + ", parse errors %d, timeouts %d, stale %d"
+                % (counters["parse_errors"], counters["timeouts"], counters["stale_samples"]))
+
+    def export(self, filename, **info):
+        """Write the snapshot (and any extra info) as JSON"""
+        snapshot = self.snapshot()
+        snapshot.update(info)
+        with open(filename, "w") as f_out:
+            json.dump(snapshot, f_out, indent=2)
@@ -1,13 +1,24 @@
 from PyQt5 import QtCore as _qc
-from PyQt5 import QtGui as _qg
-from eden import Class_PSC as _psc
+from eden import acquisition as _acq
+from eden import buffer as _buf
+from eden import command_queue as _cmd
+from eden import daemon as _dmn
+from eden import decimate as _dec
+from eden import deposition as _dep
+from eden import program as _prg
+from eden import session_file as _sf
+import collections
+import itertools
 import time
 import numpy as _np
 
-from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as _FigureCanvas
-from matplotlib.backends.backend_qt4agg import NavigationToolbar2QT as _NavigationToolbar
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as _FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as _NavigationToolbar
 import matplotlib.pyplot as _plt
 
+# line colors of the channels polled next to the main one
+CHANNEL_COLORS = "gmcyk"
+
 class Plotter(_qc.QThread):
 
     def __init__(self, gui):
@@ -15,22 +26,21 @@ class Plotter(_qc.QThread):
         self.gui = gui
         self.stop_thread = False
         
-        # define some constants
-        self.e = 1.69e-19
-        self.na = 6.02214086e23
-        self.rho_cu = 8.92 		# density in g/cm^3
-        self.m_cu = 63.546
-        
         self.surface = None
         self.charge = None
         self.mass = None
         self.thickness = None
         self.current_density = None
+        self.voltage = None
         self.time = None
+        # derived series of the other channels, by channel
+        self.channel_deposition = {}
 
         self.fig = _plt.figure()
         self.canvas = _FigureCanvas(self.fig)
         self.nav_toolbar = _NavigationToolbar(self.canvas, self.canvas)
+        self.init_plot()
+        self.canvas.mpl_connect('draw_event', self.on_draw)
 
         
     def get_surface(self):
@@ -40,64 +50,173 @@ class Plotter(_qc.QThread):
     def get_current(self):
         
         self.data = self.gui.data
+        self.channel_data = self.gui.channel_data
+        self.total_charge = self.gui.total_charge
+        self.channel_charges = self.gui.channel_charges
 
-    def integrate_current(self):
-        
-        self.charge = _np.trapz(self.data[:,1], self.data[:,0])
-        
-    def get_mass(self):
-       
-        self.mass = self.charge/self.e/2. / self.na*self.m_cu
-        
-    def get_thickness(self):
+    def update_deposition(self):
 
-        self.thickness = self.mass / self.rho_cu / self.surface
-        
-    def get_current_density(self):
-    
-        self.current_density = self.data[:,1] / self.surface * 1E3
-        
-    def get_time(self):
-        
-        self.time = self.data[:,0] - self.data[0,0]
+        # only the samples added since the last refresh get processed
+        deposition = self.gui.deposition
+        deposition.update(self.data, self.surface, self.total_charge)
+        self.charge = deposition.charge
+        self.mass = deposition.mass
+        self.thickness = deposition.thickness
+        self.time, self.current_density, self.voltage = deposition.series()
+        for channel, data in self.channel_data.items():
+            self.channel_deposition.setdefault(channel, _dep.DepositionTracker()).update(
+                data, self.surface, self.channel_charges.get(channel))
         
     def get_title(self):
     
         return self.gui.sample_name+" "+self.gui.coating_step
+
+    def init_plot(self, channels=()):
+
+        # the axes, labels, legend and grid are created once and end up in
+        # the cached background, only the data lines are redrawn
+        self.fig.clear()
+        self.ax1 = self.fig.add_subplot(111)
+        self.current_line, = self.ax1.plot([], [], '-b', label='Current', animated=True)
+        self.ax1.plot([], [], '-r', label='Voltage')
+        self.ax2 = self.ax1.twinx()
+        self.voltage_line, = self.ax2.plot([], [], '-r', label='Voltage', animated=True)
+        # only a min/max decimated copy of the data is handed to the lines
+        self.current_trace = _dec.DecimatedLine(self.current_line)
+        self.voltage_trace = _dec.DecimatedLine(self.voltage_line)
+        # a current and a voltage trace for every other channel
+        self.channels = tuple(channels)
+        self.channel_traces = {}
+        for channel, color in zip(self.channels, itertools.cycle(CHANNEL_COLORS)):
+            current_line, = self.ax1.plot([], [], '-'+color, label='Current ch '+str(channel), animated=True)
+            self.ax1.plot([], [], '--'+color, label='Voltage ch '+str(channel))
+            voltage_line, = self.ax2.plot([], [], '--'+color, animated=True)
+            self.channel_traces[channel] = (_dec.DecimatedLine(current_line),
+                                            _dec.DecimatedLine(voltage_line))
+        self.ax1.legend(loc=0)
+        self.ax1.grid()
+        self.ax1.set_xlabel("Time (s)")
+        self.ax1.set_ylabel("Current density (mA/cm^2)")
+        self.ax2.set_ylabel("Voltage (V)")
+        #_plt.title(self.get_title())
+        self.background = None
+        self.reset_extents()
+
+    def reset_extents(self):
+
+        # data extents (t_max, j_min, j_max, u_min, u_max) of the plotted rows,
+        # plotted rows by channel (None for the main one)
+        self.n_plotted = {}
+        self.extents = [0., _np.inf, -_np.inf, _np.inf, -_np.inf]
+        self.auto_limits = None
+
+    def on_draw(self, event):
+
+        # a full draw happened (rescale, resize, zoom, pan): cache the new
+        # background and put the data lines on top of it
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_lines()
+
+    def draw_lines(self):
+
+        self.ax1.draw_artist(self.current_line)
+        self.ax2.draw_artist(self.voltage_line)
+        for current_trace, voltage_trace in self.channel_traces.values():
+            self.ax1.draw_artist(current_trace.line)
+            self.ax2.draw_artist(voltage_trace.line)
+
+    def get_limits(self):
+
+        return (self.ax1.get_xlim(), self.ax1.get_ylim(), self.ax2.get_ylim())
+
+    def series(self):
+        """(time, current density, voltage) by channel, None is the main one"""
+        series = {None: (self.time, self.current_density, self.voltage)}
+        for channel in self.channels:
+            series[channel] = self.channel_deposition[channel].series()
+        return series
+
+    def update_limits(self, series):
+        """Track the extents of series(), returns True if the axes were rescaled"""
+        if any(len(values[0]) < self.n_plotted.get(key, 0) for key, values in series.items()):
+            self.reset_extents()
+        for key, (times, current_density, voltage) in series.items():
+            n_plotted = self.n_plotted.get(key, 0)
+            n_rows = len(times)
+            if n_rows <= n_plotted:
+                continue
+            new_slice = slice(n_plotted, n_rows)
+            current_density = current_density[new_slice]
+            voltage = voltage[new_slice]
+            self.extents = [max(self.extents[0], times[-1]),
+                            min(self.extents[1], _np.nanmin(current_density)),
+                            max(self.extents[2], _np.nanmax(current_density)),
+                            min(self.extents[3], _np.nanmin(voltage)),
+                            max(self.extents[4], _np.nanmax(voltage))]
+            self.n_plotted[key] = n_rows
+
+        # leave the limits alone once the user zoomed or panned
+        if self.auto_limits is not None and self.get_limits() != self.auto_limits:
+            return False
+
+        t_max, j_min, j_max, u_min, u_max = self.extents
+        x_lim, j_lim, u_lim = self.ax1.get_xlim(), self.ax1.get_ylim(), self.ax2.get_ylim()
+        if (self.auto_limits is not None and t_max <= x_lim[1]
+                and j_lim[0] <= j_min and j_max <= j_lim[1]
+                and u_lim[0] <= u_min and u_max <= u_lim[1]):
+            return False
+
+        # grow the limits with some headroom, so rescaling stays rare
+        self.ax1.set_xlim(0, max(t_max*1.25, 10.))
+        self.ax1.set_ylim(self.padded_limits(j_min, j_max))
+        self.ax2.set_ylim(self.padded_limits(u_min, u_max))
+        self.auto_limits = self.get_limits()
+        return True
+
+    @staticmethod
+    def padded_limits(lower, upper):
+
+        if not _np.isfinite(lower) or not _np.isfinite(upper):
+            return (-1., 1.)
+        span = (upper - lower) or abs(upper) or 1.
+        return (lower - 0.1*span, upper + 0.1*span)
         
     def do_plot(self):
     
-        self.fig.clear()
-        
         self.get_current()
         self.get_surface()
         
-        if self.data.any() and self.surface:
+        channels = tuple(sorted(self.channel_data))
+        if channels != self.channels:
+            # channels came or went, the background needs the new legend
+            self.init_plot(channels)
+            self.channel_deposition = {}
+
+        if _np.ndim(self.data) == 2 and len(self.data) and self.surface:
         
-            self.integrate_current()
-            self.get_mass()
-            self.get_thickness()
-            self.get_current_density()
-            self.get_time()
-            
-            
-            ax1 = self.fig.add_subplot(111)
-            plt1 = ax1.plot(self.time, self.current_density , '-b', label='Current')
-            ax1.plot(0, 0, '-r', label='Voltage')
-            ax2 = ax1.twinx()
-            plt2 = ax2.plot(self.time, self.data[:,2], '-r', label='Voltage')
-            ax1.legend(loc=0)
-            ax1.grid()
-            ax1.set_xlabel("Time (s)")
-            ax1.set_ylabel("Current density (mA/cm^2)")
-            ax2.set_ylabel("Voltage (V)")
-            '''
-            mass_string = "Deposited mass: \n" + "%.4f" % (m_cu*1e3) + " mg\n\nCoating thickness: \n" + "%.2f" % (thickness_coating*1e7) +" nm"
-            # str(m_cu*1e3) + "mg"
-            text = ax1.text(current[:,0].max()*0.65, current_density.max()*0.6, mass_string)
-            '''
-            #_plt.title(self.get_title())
+            self.update_deposition()
 
+            # one snapshot per channel, the lines and the limits agree
+            series = self.series()
+            rescaled = self.update_limits(series)
+            for key, (times, current_density, voltage) in series.items():
+                current_trace, voltage_trace = ((self.current_trace, self.voltage_trace) if key is None
+                                                else self.channel_traces[key])
+                current_trace.set_data(times, current_density)
+                voltage_trace.set_data(times, voltage)
+            if rescaled or self.background is None:
+                # triggers on_draw, which caches the background
+                self.canvas.draw()
+            else:
+                self.canvas.restore_region(self.background)
+                self.draw_lines()
+                self.canvas.blit(self.fig.bbox)
+
+        elif self.n_plotted or self.background is None:
+            # the data got cleared (or the plot was set up again)
+            self.current_trace.set_data([], [])
+            self.voltage_trace.set_data([], [])
+            self.reset_extents()
             self.canvas.draw()
 
     def run(self):
@@ -111,40 +230,131 @@ class Plotter(_qc.QThread):
             time.sleep(0.5)
         return
         
-class PscReader(_qc.QThread):
+class PscReader(_acq.Acquisition, _qc.QThread):
+    """Runs the Acquisition of the PSC on a QThread"""
 
+    command_failed = _qc.pyqtSignal(str)
 
     def __init__(self, psc_module):
-        
+
         _qc.QThread.__init__(self)
-        self.psc = psc_module
-        self.stop_thread = False
-        self.halt_thread = False
-        self.temp_file_name = "tmp_"+str(int(time.time()))+".dat"
-        self.is_recording = False
-        self.reader_data = []
-        
-    def run(self):
-        
-        f_tmp = open(self.temp_file_name, "w")
-        while True:
-            if self.stop_thread:
-                self.psc.board_busy = False
-                break
-            if self.halt_thread:
-                self.psc.board_busy = False
-                time.sleep(0.1)
-                continue
-                
-            self.psc.board_busy = True
-            self.psc.get_mea_vol()
-            self.psc.get_mea_cu()
-            timestamp = time.time()
-            voltage = self.psc.mea_vol
-            current = self.psc.mea_cu
-            f_tmp.write(str(timestamp)+' '+str(voltage)+' '+str(current)+'\n')
+        _acq.Acquisition.__init__(self, psc_module)
+        self.failure_callbacks.append(self.command_failed.emit)
+
+
+# what the GUI reads of the recorder of a channel
+RemoteRecorder = collections.namedtuple("RemoteRecorder", "charge")
+
+class RemoteReader(_acq.CommandOwner, _qc.QThread):
+    """Mirrors the acquisition of a daemon, with the interface of PscReader.
+
+    The samples are fetched into local buffers every refresh_interval. The
+    settings and is_recording of the GUI are handed over to the daemon,
+    recordings started or ended by others are followed.
+    """
+
+    command_failed = _qc.pyqtSignal(str)
+
+    def __init__(self, remote_psc, refresh_interval=0.5):
+
+        _qc.QThread.__init__(self)
+        _acq.CommandOwner.__init__(self, remote_psc)
+        self.failure_callbacks.append(self.command_failed.emit)
+        self.client = remote_psc.client
+        self.refresh_interval = refresh_interval
+        self.channel_data = {channel: _buf.SampleBuffer(n_columns=3)
+                             for channel in self.psc.channels}
+        self.reader_data = self.channel_data[self.psc.channel]
+        self.sample_info = _sf.metadata()
+        self.sample_interval = None
+        self.deadband = None
+        self.align_voltage = False
+        self.recorders = {}
+        self.target = None
+        self.status = self.client.request("status")
+        self.generation = self.status["generation"]
+        self.is_recording = self._requested_recording = self.status["recording"]
+
+    @property
+    def recording_open(self):
+        return self.status["recording_open"]
+
+    @property
+    def total_charge(self):
+        recorder = self.recorders.get(self.psc.channel)
+        return None if recorder is None else recorder.charge
+
+    def apply_setpoints(self, channel, voltage, current):
+
+        self.client.request("setpoints", voltage=voltage, current=current, channel=channel)
+
+    def start_program(self, segments, channel=None):
+        """Queue the start of a setpoint program on the daemon"""
+        if channel is None:
+            channel = self.psc.channel
+        _prg.events(segments)
+        return self.submit(self.send_program, segments, channel,
+                           priority=_cmd.SETPOINT, key=("program",))
+
+    def send_program(self, segments, channel):
+
+        self.client.request("program", segments=segments, channel=channel)
+
+    def stop_program(self):
+        """Queue the end of the setpoint program on the daemon"""
+        return self.submit(self.client.request, "stop_program",
+                           priority=_cmd.SETPOINT, key=("program",))
+
+    def sync_recording(self):
+
+        if self.is_recording != self._requested_recording:
+            # started or stopped here
+            self._requested_recording = self.is_recording
             if self.is_recording:
-                self.reader_data = _np.append(self.reader_data, ((timestamp, current, voltage)))
-                self.reader_data = self.reader_data.reshape((-1,3))
-        f_tmp.close()
-            
+                self.client.request("record", sample_info=self.sample_info,
+                                    sample_interval=self.sample_interval,
+                                    deadband=self.deadband, align_voltage=self.align_voltage,
+                                    target=None if self.target is None
+                                    else {"charge": self.target.target})
+            else:
+                self.client.request("stop_recording")
+        elif self.status["recording"] != self._requested_recording:
+            # or by someone else
+            self.is_recording = self._requested_recording = self.status["recording"]
+
+    def refresh(self):
+
+        self.status = self.client.request("status")
+        if self.status["generation"] != self.generation:
+            # a new recording starts with empty buffers
+            self.generation = self.status["generation"]
+            for buffer in self.channel_data.values():
+                buffer.clear()
+        for channel, buffer in self.channel_data.items():
+            while len(buffer) < self.status["n_rows"][str(channel)]:
+                reply = self.client.request("samples", channel=channel, start=len(buffer))
+                if reply["generation"] != self.generation or not reply["rows"]:
+                    break
+                buffer.extend(reply["rows"])
+        self.recorders = {int(channel): RemoteRecorder(charge)
+                          for channel, charge in self.status["charges"].items()}
+        # the daemon checks the target, its progress is copied
+        if self.target is not None and self.status["target"]:
+            for name in ("charge", "reached_time", "detected_time", "stopped_time"):
+                setattr(self.target, name, self.status["target"][name])
+        self.psc.update(self.status)
+
+    def run(self):
+
+        while not self.stop_thread:
+            self.commands.run_pending()
+            try:
+                self.sync_recording()
+                self.refresh()
+            except (OSError, _dmn.DaemonError) as error:
+                self.command_failed.emit(str(error))
+            time.sleep(self.refresh_interval)
+        self.commands.run_pending()
+        self.commands.cancel_all()
+        if self.close_on_stop:
+            self.psc.close_connection()